@@ -0,0 +1,102 @@
+import hashlib
+
+# Creator analytics: per-course enrollment and completion counts, a completion funnel and
+# per-question accuracy, kept in rollup tables. The receivers below bump them in the same
+# transaction as the progress event that caused them (see the Progress Events section of app.py),
+# so the creator pages read O(courses) rows instead of scanning every student's progress, and
+# compact() rebuilds them from their sources now and then.
+#
+# The rollup models stay with the others in app.py; CreatorAnalytics is handed them, the
+# SQLAlchemy handle and the conflict-ignoring insert, much as LLMGateway is handed its backend.
+
+def question_key(question):
+    return hashlib.sha256((question or '').encode('utf-8')).hexdigest()[:16]
+
+class CreatorAnalytics:
+    def __init__(self, db, insert_ignoring_conflicts, course, lesson, enrollment, course_stats, chapter_stats, question_stats):
+        self.db = db
+        self.insert_ignoring_conflicts = insert_ignoring_conflicts
+        self.Course = course
+        self.Lesson = lesson
+        self.Enrollment = enrollment
+        self.CourseStats = course_stats
+        self.ChapterProgressStats = chapter_stats
+        self.QuestionStats = question_stats
+
+    # Connected strongly: a weakly held bound method would be dropped along with a temporary instance.
+    def connect(self, signals):
+        signals.signal('student-enrolled').connect(self.roll_up_enrollment, weak=False)
+        signals.signal('progress-changed').connect(self.roll_up_progress, weak=False)
+        signals.signal('question-answered').connect(self.roll_up_answer, weak=False)
+        signals.signal('review-submitted').connect(self.roll_up_review, weak=False)
+
+    def bump(self, model, keys, defaults=None, **deltas):
+        self.insert_ignoring_conflicts(model, **keys, **(defaults or {}), **{column: 0 for column in deltas})
+        model.query.filter_by(**keys).update({column: getattr(model, column) + delta for column, delta in deltas.items()}, synchronize_session=False)
+
+    # --- Receivers ---
+    def roll_up_enrollment(self, sender, course_id, **extra):
+        self.bump(self.CourseStats, {'course_id': course_id}, enrollments=1)
+        self.bump(self.ChapterProgressStats, {'course_id': course_id, 'chapter_number': 0}, enrollments=1)
+
+    # ChapterProgressStats is a histogram of last completed chapters, so progress moves one
+    # enrollment from its old bucket to its new one.
+    def roll_up_progress(self, sender, course_id, previous_chapter, chapter_number, course_completed, **extra):
+        if previous_chapter is not None:
+            self.bump(self.ChapterProgressStats, {'course_id': course_id, 'chapter_number': previous_chapter}, enrollments=-1)
+            self.bump(self.ChapterProgressStats, {'course_id': course_id, 'chapter_number': chapter_number}, enrollments=1)
+        if course_completed:
+            self.bump(self.CourseStats, {'course_id': course_id}, completions=1)
+
+    def roll_up_answer(self, sender, lesson_id, step, is_correct, **extra):
+        question = step.get('question') or ''
+        self.bump(self.QuestionStats, {'lesson_id': lesson_id, 'question_key': question_key(question)}, {'question': question},
+                  attempts=1, correct=1 if is_correct else 0)
+
+    def roll_up_review(self, sender, course_id, rating, **extra):
+        Course = self.Course
+        Course.query.filter_by(id=course_id).update({'review_count': Course.review_count + 1, 'rating_sum': Course.rating_sum + rating}, synchronize_session=False)
+
+    # --- Reads ---
+    def course_stats(self, course_ids):
+        CourseStats = self.CourseStats
+        return {stats.course_id: stats for stats in CourseStats.query.filter(CourseStats.course_id.in_(course_ids))} if course_ids else {}
+
+    # [(chapter_number, enrollments that completed at least that chapter)] for chapters 1..lesson_count.
+    def completion_funnel(self, course):
+        ChapterProgressStats = self.ChapterProgressStats
+        buckets = dict(self.db.session.query(ChapterProgressStats.chapter_number, ChapterProgressStats.enrollments).filter_by(course_id=course.id))
+        funnel, reached = [], sum(count for chapter, count in buckets.items() if chapter > course.lesson_count)
+        for chapter_number in range(course.lesson_count, 0, -1):
+            reached += buckets.get(chapter_number, 0)
+            funnel.append((chapter_number, reached))
+        return funnel[::-1]
+
+    # [(chapter_number, question, attempts, correct)] in chapter order.
+    def question_accuracy(self, course_id):
+        Lesson, QuestionStats = self.Lesson, self.QuestionStats
+        return self.db.session.query(Lesson.chapter_number, QuestionStats.question, QuestionStats.attempts, QuestionStats.correct).join(
+            Lesson, Lesson.id == QuestionStats.lesson_id).filter(Lesson.course_id == course_id).order_by(Lesson.chapter_number, QuestionStats.question).all()
+
+    # --- Compaction ---
+    # Enrollment rollups are recounted in two GROUP BY passes, which also absorbs chapters deleted
+    # or renumbered since the increments were applied. Answers are not kept anywhere else, so
+    # question stats are only pruned: rows for questions that live_questions(lesson) no longer
+    # lists go. Returns (courses counted, question rows pruned).
+    def compact(self, live_questions):
+        db, Enrollment, Lesson = self.db, self.Enrollment, self.Lesson
+        CourseStats, ChapterProgressStats, QuestionStats = self.CourseStats, self.ChapterProgressStats, self.QuestionStats
+        CourseStats.query.delete(synchronize_session=False)
+        ChapterProgressStats.query.delete(synchronize_session=False)
+        courses = 0
+        for course_id, enrollments, completions in db.session.query(Enrollment.course_id, db.func.count(Enrollment.id), db.func.count(Enrollment.completed_at)).group_by(Enrollment.course_id):
+            db.session.add(CourseStats(course_id=course_id, enrollments=enrollments, completions=completions))
+            courses += 1
+        for course_id, chapter_number, enrollments in db.session.query(Enrollment.course_id, Enrollment.last_completed_chapter_number, db.func.count(Enrollment.id)).group_by(Enrollment.course_id, Enrollment.last_completed_chapter_number):
+            db.session.add(ChapterProgressStats(course_id=course_id, chapter_number=chapter_number, enrollments=enrollments))
+        pruned = 0
+        for lesson in Lesson.query.filter(Lesson.id.in_(db.session.query(QuestionStats.lesson_id).distinct())):
+            live_keys = [question_key(question) for question in live_questions(lesson)]
+            pruned += QuestionStats.query.filter(QuestionStats.lesson_id == lesson.id, QuestionStats.question_key.notin_(live_keys)).delete(synchronize_session=False)
+        db.session.commit()
+        return courses, pruned
@@ -1,36 +1,121 @@
 import os
 import json
 import uuid
-import google.generativeai as genai
-from flask import Flask, request, render_template, jsonify, url_for, flash, redirect, session, abort
+import base64
+import hashlib
+import difflib
+import io
+import re
+import zipfile
+import threading
+import multiprocessing
+import sqlite3
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import click
+from blinker import Namespace
+from flask import Flask, request, render_template, jsonify, url_for, flash, redirect, session, abort, Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.hybrid import hybrid_property
 from flask_migrate import Migrate
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.datastructures import FileStorage
 from dotenv import load_dotenv
 import datetime
+import analytics
+import lesson_engine
+import lesson_parser
+import lesson_search
+import grading
+import media_variants
+from llm_gateway import LLMGateway, LLMBusyError, create_backend
 
 # --- Initialization ---
 load_dotenv()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "a-strong-default-secret-key-for-dev")
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///coursewell.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", "sqlite:///coursewell.db").replace('postgres://', 'postgresql://', 1)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+app.config['DB_POOL_SIZE'] = int(os.getenv("DB_POOL_SIZE", 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv("DB_MAX_OVERFLOW", 20))
+app.config['DB_POOL_TIMEOUT'] = float(os.getenv("DB_POOL_TIMEOUT", 30))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv("DB_POOL_RECYCLE", 1800))
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config['PARSE_CACHE_MAX_BYTES'] = int(os.getenv("PARSE_CACHE_MAX_BYTES", 5 * 1024 * 1024))
+app.config['LLM_BACKEND'] = os.getenv("LLM_BACKEND", "gemini")
+app.config['LLM_MODEL'] = os.getenv("LLM_MODEL", "gemini-1.5-pro-latest")
+app.config['LLM_MAX_WORKERS'] = int(os.getenv("LLM_MAX_WORKERS", 8))
+# Model calls and streams a process admits at once (running plus waiting); the rest get a "busy"
+# reply. Keep it below the process's request threads (e.g. gunicorn --threads) so a burst of chat
+# requests cannot tie up every thread waiting on the model.
+app.config['LLM_MAX_QUEUE'] = int(os.getenv("LLM_MAX_QUEUE", 16))
+app.config['LLM_MAX_BACKGROUND'] = int(os.getenv("LLM_MAX_BACKGROUND", 2))  # of those, how many pre-generation may hold
+app.config['LLM_TIMEOUT'] = float(os.getenv("LLM_TIMEOUT", 60))
+app.config['LLM_RETRIES'] = int(os.getenv("LLM_RETRIES", 2))
+app.config['LLM_FAKE_LATENCY'] = float(os.getenv("LLM_FAKE_LATENCY", 0))
+app.config['EXPLORE_PAGE_SIZE'] = int(os.getenv("EXPLORE_PAGE_SIZE", 24))
+app.config['INGEST_WORKER_THREADS'] = int(os.getenv("INGEST_WORKER_THREADS", 1))
+app.config['INGEST_POLL_INTERVAL'] = float(os.getenv("INGEST_POLL_INTERVAL", 1))
+app.config['INGEST_JOB_TIMEOUT'] = int(os.getenv("INGEST_JOB_TIMEOUT", 15 * 60))
+app.config['QNA_CONTEXT_TOKENS'] = int(os.getenv("QNA_CONTEXT_TOKENS", 1500))
+app.config['QNA_TOP_K'] = int(os.getenv("QNA_TOP_K", 4))
+app.config['QNA_SUMMARY_TOKENS'] = int(os.getenv("QNA_SUMMARY_TOKENS", 200))
+app.config['SEARCH_CHUNK_TOKENS'] = int(os.getenv("SEARCH_CHUNK_TOKENS", 120))
+app.config['QNA_CACHE_TTL'] = int(os.getenv("QNA_CACHE_TTL", 7 * 24 * 60 * 60))
+app.config['QNA_CACHE_MAX_PER_LESSON'] = int(os.getenv("QNA_CACHE_MAX_PER_LESSON", 200))
+app.config['QNA_CACHE_SIMILARITY'] = float(os.getenv("QNA_CACHE_SIMILARITY", 0.8))  # above 1 turns similarity matching off
+app.config['SA_GRADER_ACCEPT_AT'] = float(os.getenv("SA_GRADER_ACCEPT_AT", 0.9))
+app.config['COMPILED_LESSON_CACHE_SIZE'] = int(os.getenv("COMPILED_LESSON_CACHE_SIZE", 256))
+app.config['SA_GRADER_REJECT_BELOW'] = float(os.getenv("SA_GRADER_REJECT_BELOW", 0.34))  # 0 sends every non-match to the model
+app.config['MEDIA_VARIANT_WIDTHS'] = [int(width) for width in os.getenv("MEDIA_VARIANT_WIDTHS", "320,640,1280").split(',') if width.strip()]
+app.config['MEDIA_CACHE_MAX_AGE'] = int(os.getenv("MEDIA_CACHE_MAX_AGE", 365 * 24 * 60 * 60))
+app.config['CHAPTER_PREFETCH_STEPS'] = int(os.getenv("CHAPTER_PREFETCH_STEPS", 3))  # how close to the end of a chapter to warm the next one
+app.config['CHAPTER_PREFETCH_TTL'] = int(os.getenv("CHAPTER_PREFETCH_TTL", 10 * 60))
+
+# --- Database Engine ---
+# SQLite for a single node (WAL, so readers never wait on the writer, plus a busy timeout so
+# writers queue instead of failing with "database is locked"), or a pooled PostgreSQL for several.
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+else:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': app.config['DB_POOL_SIZE'], 'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'], 'pool_recycle': app.config['DB_POOL_RECYCLE'], 'pool_pre_ping': True}
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection): return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")  # durable across app crashes; WAL keeps it consistent across power loss
+    cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    cursor.execute("PRAGMA cache_size=-20000")  # 20 MB page cache per connection
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+llm = LLMGateway(
+    create_backend(app.config['LLM_BACKEND'], app.config['LLM_MODEL'], api_key=os.getenv("GEMINI_API_KEY"), fake_latency=app.config['LLM_FAKE_LATENCY']),
+    max_workers=app.config['LLM_MAX_WORKERS'], max_queue=app.config['LLM_MAX_QUEUE'], max_background=app.config['LLM_MAX_BACKGROUND'],
+    timeout=app.config['LLM_TIMEOUT'], retries=app.config['LLM_RETRIES'])
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # --- Database Models ---
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))  # scrypt hashes run to ~160 characters
     courses = db.relationship('Course', backref='creator', lazy=True, cascade="all, delete-orphan")
     enrollments = db.relationship('Enrollment', back_populates='user', lazy='dynamic', cascade="all, delete-orphan")
     reviews = db.relationship('Review', backref='user', lazy='dynamic')
@@ -41,8 +126,15 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    # Loaded once per request (as is the user), so every later is_enrolled check is free.
+    @property
+    def enrolled_course_ids(self):
+        if getattr(self, '_enrolled_course_ids', None) is None:
+            self._enrolled_course_ids = {course_id for (course_id,) in db.session.query(Enrollment.course_id).filter_by(user_id=self.id)}
+        return self._enrolled_course_ids
+
     def is_enrolled(self, course):
-        return self.enrollments.filter_by(course_id=course.id).count() > 0
+        return course.id in self.enrolled_course_ids
 
 class Course(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -55,12 +147,22 @@ class Course(db.Model):
     thumbnail_url = db.Column(db.String(255), nullable=True)
     reviews = db.relationship('Review', backref='course', lazy='dynamic')
     shareable_link_id = db.Column(db.String(36), unique=True, nullable=True)
+    # Denormalized so listing pages never count rows per course; updated with SQL increments.
+    lesson_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Off: questions, images and hints use lesson_engine's templates and only lesson text goes
+    # through the model. On: the model paraphrases every turn.
+    llm_paraphrase = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    __table_args__ = (
+        db.Index('ix_course_published_title_id', 'is_published', 'title', 'id'),
+        db.Index('ix_course_user_title', 'user_id', 'title'),
+    )
 
     @property
     def average_rating(self):
-        reviews = self.reviews.all()
-        if not reviews: return 0
-        return sum(r.rating for r in reviews) / len(reviews)
+        if not self.review_count: return 0
+        return self.rating_sum / self.review_count
 
 class Lesson(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -69,6 +171,21 @@ class Lesson(db.Model):
     parsed_json = db.Column(db.Text, nullable=False)
     course_id = db.Column(db.String(36), db.ForeignKey('course.id'), nullable=False)
     chapter_number = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='parsed', server_default='parsed')  # pending / parsed / failed
+    search_index_json = db.Column(db.Text, nullable=True)  # lesson_search BM25 index over raw_script
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # bumped whenever parsed_json changes
+    tutor_turns = db.relationship('TutorTurn', backref='lesson', lazy='dynamic', cascade="all, delete-orphan")
+    ingest_jobs = db.relationship('IngestJob', backref='lesson', lazy='dynamic', cascade="all, delete-orphan", order_by="IngestJob.created_at.desc()")
+    qna_answers = db.relationship('QnaAnswer', backref='lesson', lazy='dynamic', cascade="all, delete-orphan")
+    question_stats = db.relationship('QuestionStats', lazy='dynamic', cascade="all, delete-orphan")
+    # Not unique: reorder_chapters renumbers one row at a time.
+    __table_args__ = (db.Index('ix_lesson_course_chapter', 'course_id', 'chapter_number'),)
+
+    # A chapter that has never been parsed has nothing to play yet; an edited one keeps its last version.
+    # A hybrid, so queries (playable_chapter_numbers) filter on the same test.
+    @hybrid_property
+    def is_playable(self):
+        return self.parsed_json != EMPTY_LESSON_JSON
 
 class Enrollment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -79,16 +196,44 @@ class Enrollment(db.Model):
     user = db.relationship('User', back_populates='enrollments')
     course = db.relationship('Course', back_populates='enrollees')
     chat_histories = db.relationship('ChatHistory', backref='enrollment', lazy='dynamic', cascade="all, delete-orphan")
-    __table_args__ = (db.UniqueConstraint('user_id', 'course_id', name='_user_course_uc'),)
+    chat_turns = db.relationship('ChatTurn', backref='enrollment', lazy='dynamic', cascade="all, delete-orphan")
+    # The unique constraint leads with user_id; course-side lookups (enrollees, deletes) need their own index.
+    __table_args__ = (db.UniqueConstraint('user_id', 'course_id', name='_user_course_uc'), db.Index('ix_enrollment_course_id', 'course_id'))
 
 class ChatHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
     lesson_id = db.Column(db.String(36), db.ForeignKey('lesson.id'), nullable=False)
-    history_json = db.Column(db.Text, nullable=False, default='[]')
     current_step_index = db.Column(db.Integer, nullable=False, default=0)
+    last_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    summary = db.Column(db.Text, nullable=False, default='', server_default='')  # rolling digest of recent turns for QNA prompts
     __table_args__ = (db.UniqueConstraint('enrollment_id', 'lesson_id', name='_enrollment_lesson_uc'),)
 
+    def turns_query(self):
+        return ChatTurn.query.filter_by(enrollment_id=self.enrollment_id, lesson_id=self.lesson_id)
+
+    def messages(self):
+        return [turn.as_message() for turn in self.turns_query().order_by(ChatTurn.seq)]
+
+    def append_turn(self, role, text):
+        self.last_seq = (self.last_seq or 0) + 1
+        db.session.add(ChatTurn(enrollment_id=self.enrollment_id, lesson_id=self.lesson_id, seq=self.last_seq, role=role, text=text))
+
+class ChatTurn(db.Model):
+    # One message of a lesson conversation. Turns are only ever appended or range-deleted,
+    # so a chat turn costs the same however long the conversation already is.
+    id = db.Column(db.Integer, primary_key=True)
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
+    lesson_id = db.Column(db.String(36), db.ForeignKey('lesson.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    role = db.Column(db.String(10), nullable=False)  # 'user' or 'model', as Gemini names them
+    text = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('enrollment_id', 'lesson_id', 'seq', name='_enrollment_lesson_seq_uc'),)
+
+    def as_message(self):
+        return {'role': self.role, 'parts': [{'text': self.text}]}
+
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     rating = db.Column(db.Integer, nullable=False)
@@ -96,7 +241,108 @@ class Review(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
     course_id = db.Column(db.String(36), db.ForeignKey('course.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    __table_args__ = (db.UniqueConstraint('user_id', 'course_id', name='_user_course_review_uc'),)
+    __table_args__ = (db.UniqueConstraint('user_id', 'course_id', name='_user_course_review_uc'), db.Index('ix_review_course_created_at', 'course_id', 'created_at'))
+
+class ParseCache(db.Model):
+    # Keyed by sha256(PARSER_PROMPT_VERSION + script) so a prompt change invalidates every entry.
+    key = db.Column(db.String(64), primary_key=True)
+    parsed_json = db.Column(db.Text, nullable=False)
+    size_bytes = db.Column(db.Integer, nullable=False)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+
+class TutorTurn(db.Model):
+    # A tutor turn rendered ahead of time. Keyed by the hash of the prompt that produced it,
+    # so an edited step simply stops matching and its turn goes stale.
+    id = db.Column(db.Integer, primary_key=True)
+    lesson_id = db.Column(db.String(36), db.ForeignKey('lesson.id'), nullable=False)
+    prompt_hash = db.Column(db.String(64), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('lesson_id', 'prompt_hash', name='_lesson_prompt_uc'),)
+
+class QnaAnswer(db.Model):
+    # A model answer to a student question, shared by everyone in the lesson. Keyed by the
+    # normalized question and the lesson version it was answered from, so an edit retires it.
+    id = db.Column(db.Integer, primary_key=True)
+    lesson_id = db.Column(db.String(36), db.ForeignKey('lesson.id'), nullable=False)
+    lesson_version = db.Column(db.String(16), nullable=False)
+    question_key = db.Column(db.String(500), nullable=False)
+    answer = db.Column(db.Text, nullable=False)  # raw model text, [RETRIEVE_IMAGE: ...] tags included
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('lesson_id', 'lesson_version', 'question_key', name='_lesson_version_question_uc'),)
+
+class GradeVerdict(db.Model):
+    # The model's verdict on a short answer it had to grade, keyed by
+    # sha256(GRADER_PROMPT_VERSION + step question and keywords + normalized answer).
+    key = db.Column(db.String(64), primary_key=True)
+    is_correct = db.Column(db.Boolean, nullable=False)
+    hit_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+class MediaBlob(db.Model):
+    # An uploaded file, stored once as UPLOAD_FOLDER/<sha256><extension> however many lessons and
+    # courses use it. ref_count mirrors the MediaRef rows; media-gc removes blobs left at zero.
+    key = db.Column(db.String(64), primary_key=True)
+    extension = db.Column(db.String(16), nullable=False, default='')
+    size_bytes = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    released_at = db.Column(db.DateTime, nullable=True)  # when a reference was last dropped
+    # Resized WebP copies (<key>-<width>.webp), made by the ingest workers after upload.
+    width = db.Column(db.Integer, nullable=True)  # None for anything that is not a still image
+    variant_widths_json = db.Column(db.Text, nullable=False, default='[]', server_default='[]')
+    variant_status = db.Column(db.String(16), nullable=False, default='pending', server_default='pending')  # pending / running / done
+    variant_started_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (db.Index('ix_media_blob_variant_status_created_at', 'variant_status', 'created_at'),)
+
+class MediaRef(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    blob_key = db.Column(db.String(64), db.ForeignKey('media_blob.key'), nullable=False)
+    owner_type = db.Column(db.String(16), nullable=False)  # 'lesson' or 'course'
+    owner_id = db.Column(db.String(36), nullable=False)
+    __table_args__ = (db.UniqueConstraint('owner_type', 'owner_id', 'blob_key', name='_media_owner_blob_uc'),)
+
+class CourseStats(db.Model):
+    # Creator analytics rollups. They are kept current by the progress event receivers (see
+    # analytics.py) and reconciled against their sources by `flask analytics-compact`.
+    course_id = db.Column(db.String(36), db.ForeignKey('course.id'), primary_key=True)
+    enrollments = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completions = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+class ChapterProgressStats(db.Model):
+    # Enrollments whose last completed chapter is chapter_number (0: none yet). The completion
+    # funnel is the running total from the last chapter down.
+    course_id = db.Column(db.String(36), db.ForeignKey('course.id'), primary_key=True)
+    chapter_number = db.Column(db.Integer, primary_key=True)
+    enrollments = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+class QuestionStats(db.Model):
+    # Graded answers per question, keyed by the question text so edits that move it keep its stats.
+    lesson_id = db.Column(db.String(36), db.ForeignKey('lesson.id'), primary_key=True)
+    question_key = db.Column(db.String(16), primary_key=True)
+    question = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    correct = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+class IngestJob(db.Model):
+    # Chapter ingestion work (parse + media binding + turn pre-generation), claimed by ingest workers.
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    lesson_id = db.Column(db.String(36), db.ForeignKey('lesson.id'), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')  # pending / running / done / failed
+    payload_json = db.Column(db.Text, nullable=False, default='{}')
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (
+        db.Index('ix_ingest_job_status_created_at', 'status', 'created_at'),
+        db.Index('ix_ingest_job_lesson_created_at', 'lesson_id', 'created_at'),
+    )
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -124,30 +370,42 @@ TUTOR_PROMPT_TEMPLATE = {
     "FEEDBACK_AND_PROCEED": "The student just answered a question correctly. Your response should start with a positive confirmation (like 'Exactly!' or 'Great job!') and then seamlessly transition into teaching the following new concept. Here is the new concept: --- {} ---",
     "QNA": """
 You are an intelligent teaching assistant. A student has a question.
-Your knowledge is strictly limited to the following "Full Lesson Script".
-The script contains text and image tags like [IMAGE: alt="description"].
+Your knowledge is strictly limited to the following "Lesson Excerpts", taken from the lesson script.
+The excerpts contain text and image tags like [IMAGE: alt="description"].
 
 Your Task:
-1. Read the student's question.
-2. Analyze the "Full Lesson Script" to find the answer.
-3. **If the student is asking to see an image mentioned in the script (e.g., "show me the capybara", "can I see the image?"), your response MUST be ONLY the following machine-readable tag: `[RETRIEVE_IMAGE: "description"]`, where "description" is the exact alt text from the corresponding [IMAGE] tag in the script.**
-4. For any other question, answer it normally based on the script's text content. If you cannot answer, say so politely.
+1. Read the student's question. The "Conversation So Far" is only there to help you understand it.
+2. Analyze the "Lesson Excerpts" to find the answer.
+3. **If the student is asking to see an image mentioned in the excerpts (e.g., "show me the capybara", "can I see the image?"), your response MUST be ONLY the following machine-readable tag: `[RETRIEVE_IMAGE: "description"]`, where "description" is the exact alt text from the corresponding [IMAGE] tag.**
+4. For any other question, answer it normally based on the excerpts' text content. If you cannot answer, say so politely.
 
 ---
-Full Lesson Script:
+Lesson Excerpts:
 {lesson_script}
 ---
+Conversation So Far:
+{conversation_summary}
+---
 Student's Question: {user_question}
 """,
     "QUESTION": "Okay, time for a quick question to check your understanding: {}"
 }
+EMPTY_LESSON_JSON = json.dumps({'steps': []})
+PARSER_PROMPT_VERSION = hashlib.sha256(PARSER_PROMPT.encode('utf-8')).hexdigest()[:12]
+GRADER_PROMPT_VERSION = hashlib.sha256(GRADER_PROMPT.encode('utf-8')).hexdigest()[:12]
 
 # --- Helper Functions ---
 def parse_lesson_script(script_text):
     try:
-        model = genai.GenerativeModel('gemini-1.5-pro-latest')
-        response = model.generate_content(PARSER_PROMPT + script_text)
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "").strip()
+        return lesson_parser.parse_script(script_text)
+    except lesson_parser.ScriptParseError as e:
+        print(f"Local parser rejected script, falling back to the model: {e}")
+    return parse_lesson_script_with_model(script_text)
+
+def parse_lesson_script_with_model(script_text):
+    try:
+        response_text = generate_text(PARSER_PROMPT + script_text)
+        cleaned_response = response_text.strip().replace("```json", "").replace("```", "").strip()
         parsed_json = json.loads(cleaned_response)
         for step in parsed_json.get('steps', []):
             if step.get('type') == 'QUESTION_SA' and 'keywords' in step:
@@ -159,14 +417,592 @@ def parse_lesson_script(script_text):
         print(f"Error during parsing: {e}")
         return None
 
+def parse_cache_key(script_text):
+    return hashlib.sha256(f"{PARSER_PROMPT_VERSION}\0{script_text}".encode('utf-8')).hexdigest()
+
+def evict_parse_cache(max_bytes):
+    total = db.session.query(db.func.coalesce(db.func.sum(ParseCache.size_bytes), 0)).scalar()
+    if total <= max_bytes: return
+    for entry in ParseCache.query.order_by(ParseCache.last_used_at).yield_per(100):
+        if total <= max_bytes: break
+        total -= entry.size_bytes
+        db.session.delete(entry)
+
+# Cache writes join the caller's transaction, so they only land if the caller commits.
+def cached_parse_lesson_script(script_text):
+    key = parse_cache_key(script_text)
+    entry = ParseCache.query.get(key)
+    if entry:
+        entry.hit_count += 1
+        entry.last_used_at = datetime.datetime.utcnow()
+        return json.loads(entry.parsed_json)
+    parsed_data = parse_lesson_script_with_model(script_text)
+    if parsed_data:
+        payload = json.dumps(parsed_data)
+        db.session.add(ParseCache(key=key, parsed_json=payload, size_bytes=len(payload.encode('utf-8'))))
+        db.session.flush()
+        evict_parse_cache(app.config['PARSE_CACHE_MAX_BYTES'])
+    return parsed_data
+
+# Each segment is parsed on its own: well-formed segments locally, the rest through the
+# cached model call, so an edit only costs model calls for the segments that changed.
+def parse_script_incrementally(script_text):
+    steps = []
+    for segment in lesson_parser.split_segments(script_text):
+        try:
+            steps.extend(lesson_parser.parse_segment(segment))
+            continue
+        except lesson_parser.ScriptParseError as e:
+            print(f"Local parser rejected a segment, falling back to the model: {e}")
+        parsed_segment = cached_parse_lesson_script(segment)
+        if not parsed_segment: return None
+        steps.extend(parsed_segment.get('steps', []))
+    return {'steps': steps} if steps else None
+
+# media_positions[i], when the editor sent it, is the MEDIA step (counted in script order) that
+# upload i was inserted for, so a new upload always wins over an old url. The edit page also sends
+# kept_urls: for each MEDIA step, the url of the existing image shown after its tag (or None), so
+# every other step keeps exactly the picture the creator saw there. Without it (archive imports,
+# API clients) other MEDIA steps keep the url of the previous step with the same alt text at the
+# same position among those sharing it; an upload counts as taking a position when its alt text
+# is no more frequent than before (a replacement) and not when it is (an insertion). Whatever is
+# still unbound takes the remaining uploads in order.
+def bind_media_urls(steps, media_urls, previous_steps=(), media_positions=(), kept_urls=None):
+    previous_urls = {}
+    for step in previous_steps:
+        if step.get('type') == 'MEDIA' and step.get('media_url'):
+            previous_urls.setdefault(step.get('alt_text'), []).append(step['media_url'])
+    media_steps = [step for step in steps if step.get('type') == 'MEDIA']
+    if len(media_positions) != len(media_urls) or len(set(media_positions)) != len(media_positions): media_positions = ()
+    uploads = {position: url for position, url in zip(media_positions, media_urls) if 0 <= position < len(media_steps)}
+    unplaced_urls = iter([url for url in media_urls if url not in uploads.values()])
+    if kept_urls is not None:
+        # Only urls this chapter already used: the form cannot borrow another lesson's media.
+        used = {url for urls in previous_urls.values() for url in urls}
+        for position, step in enumerate(media_steps):
+            kept_url = kept_urls[position] if position < len(kept_urls) and kept_urls[position] in used else None
+            media_url = uploads.get(position) or kept_url or next(unplaced_urls, None)
+            if media_url: step['media_url'] = media_url
+        return
+    alt_counts = Counter(step.get('alt_text') for step in media_steps)
+    seen = Counter()
+    for position, step in enumerate(media_steps):
+        same_alt_urls = previous_urls.get(step.get('alt_text'), [])
+        if position in uploads:
+            step['media_url'] = uploads[position]
+            if alt_counts[step.get('alt_text')] <= len(same_alt_urls): seen[step.get('alt_text')] += 1
+            continue
+        occurrence = seen[step.get('alt_text')]
+        seen[step.get('alt_text')] += 1
+        media_url = same_alt_urls[occurrence] if occurrence < len(same_alt_urls) else next(unplaced_urls, None)
+        if media_url: step['media_url'] = media_url
+
+# The editor's upload -> MEDIA step positions; anything malformed falls back to binding in order.
+def media_positions_from_form():
+    try:
+        positions = json.loads(request.form.get('media_positions') or '[]')
+    except ValueError:
+        return []
+    return positions if isinstance(positions, list) and all(isinstance(p, int) for p in positions) else []
+
+# The edit page's MEDIA step -> kept url list, or None (bind by alt text) when it sent none or it is malformed.
+def kept_media_urls_from_form():
+    try:
+        kept_urls = json.loads(request.form.get('media_kept') or 'null')
+    except ValueError:
+        return None
+    return kept_urls if isinstance(kept_urls, list) and all(url is None or isinstance(url, str) for url in kept_urls) else None
+
+# The url each MEDIA step of the current version shows, in script order, for the edit page.
+def media_step_urls(lesson):
+    return [step.get('media_url') for step in json.loads(lesson.parsed_json).get('steps', []) if step.get('type') == 'MEDIA']
+
+def generate_text(prompt):
+    return llm.generate(prompt)
+
+def stream_text(prompt):
+    return llm.stream(prompt)
+
+EMPTY_TUTOR_REPLY = "Let's try that another way."
+FAILED_TUTOR_REPLY = "I seem to be having a little trouble thinking. Could you try again?"
+
 def get_tutor_response(full_prompt):
     try:
-        model = genai.GenerativeModel('gemini-1.5-pro-latest')
-        response = model.generate_content(full_prompt)
-        return response.text if response.text else "Let's try that another way."
+        response_text = generate_text(full_prompt)
+        return response_text if response_text else EMPTY_TUTOR_REPLY
     except Exception as e:
         print(f"Error getting tutor response: {e}")
-        return "I seem to be having a little trouble thinking. Could you try again?"
+        return FAILED_TUTOR_REPLY
+
+# Several replies at once: the calls run concurrently on the gateway's pool, in waves no bigger than
+# its workers or its queue, and the replies come back in prompt order. A None prompt gives a None reply.
+# Callers stop at the first failed reply, so once a call fails the rest are not made.
+def get_tutor_responses(prompts):
+    replies = [FAILED_TUTOR_REPLY if prompt else None for prompt in prompts]
+    pending = [i for i, prompt in enumerate(prompts) if prompt]
+    wave, failed = min(llm.max_workers, llm.max_queue), False
+    for start in range(0, len(pending), wave):
+        futures = {}
+        for i in pending[start:start + wave]:
+            try:
+                futures[i] = llm.submit(prompts[i])
+            except LLMBusyError as e:
+                print(f"Error getting tutor response: {e}")
+                failed = True
+                break
+        for i, future in futures.items():
+            try:
+                replies[i] = llm.result(future) or EMPTY_TUTOR_REPLY
+            except Exception as e:
+                print(f"Error getting tutor response: {e}")
+                failed = True
+        if failed: break
+    return replies
+
+# `outcome['complete']` is set once the model finished a non-empty reply, so callers can tell a
+# real answer from a fallback or a stream cut short.
+def stream_tutor_response(full_prompt, outcome=None):
+    streamed_any = False
+    try:
+        for text in stream_text(full_prompt):
+            streamed_any = True
+            yield text
+        if not streamed_any: yield EMPTY_TUTOR_REPLY
+        elif outcome is not None: outcome['complete'] = True
+    except Exception as e:
+        print(f"Error streaming tutor response: {e}")
+        if not streamed_any: yield FAILED_TUTOR_REPLY
+
+# Student-independent turns: the prompt only depends on the lesson step, so it can be rendered once.
+PRERENDERED_VARIANTS = {
+    'CONTENT': ('DEFAULT', 'FEEDBACK'),
+    'MEDIA': ('DEFAULT',),
+    'QUESTION_MCQ': ('DEFAULT',),
+    'QUESTION_SA': ('DEFAULT',),
+}
+# Without llm_paraphrase the other turns are templated (see lesson_engine), so only lesson text is.
+# RETRY hints are pre-rendered for every question either way.
+TEMPLATED_PRERENDERED_VARIANTS = {'CONTENT': ('DEFAULT',)}
+
+def tutor_prompt_for_step(step, variant='DEFAULT'):
+    step_type = step.get('type')
+    if step_type == 'CONTENT':
+        template = TUTOR_PROMPT_TEMPLATE['FEEDBACK_AND_PROCEED'] if variant == 'FEEDBACK' else TUTOR_PROMPT_TEMPLATE['CONTENT']
+        return template.format(step.get('text', ''))
+    if step_type == 'MEDIA':
+        return TUTOR_PROMPT_TEMPLATE['MEDIA'].format(step.get('alt_text', ''))
+    if step_type in ['QUESTION_MCQ', 'QUESTION_SA']:
+        return TUTOR_PROMPT_TEMPLATE['QUESTION'].format(step.get('question', 'a question'))
+    return None
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+# The hint for a wrong answer only depends on the lesson text before the question.
+def retry_prompt(compiled, step_index):
+    return TUTOR_PROMPT_TEMPLATE['RETRY'].format(compiled.content_before(step_index) or "Let's review.")
+
+# Returns (text, None) when the turn was pre-rendered, otherwise (None, prompt) for a live model call.
+def prerendered_turn(lesson_id, prompt):
+    turn = TutorTurn.query.filter_by(lesson_id=lesson_id, prompt_hash=prompt_hash(prompt)).first()
+    return (turn.text, None) if turn else (None, prompt)
+
+def step_turn(lesson_id, step, variant='DEFAULT'):
+    return prerendered_turn(lesson_id, tutor_prompt_for_step(step, variant))
+
+# The model-backed renderers for lesson_engine: pre-rendered turns where they exist, otherwise a
+# live call. Courses without llm_paraphrase only use CONTENT and RETRY from here.
+def model_step_renderers(lesson_id):
+    def prerendered(variant):
+        return lambda compiled, step_index: step_turn(lesson_id, compiled.steps[step_index], variant)
+    def retry(compiled, step_index):
+        return prerendered_turn(lesson_id, retry_prompt(compiled, step_index))
+    return {'CONTENT': prerendered('DEFAULT'), 'FEEDBACK': prerendered('FEEDBACK'), 'MEDIA': prerendered('DEFAULT'), 'QUESTION': prerendered('DEFAULT'), 'RETRY': retry}
+
+def pregenerate_tutor_turns(lesson_id):
+    lesson = Lesson.query.get(lesson_id)
+    if not lesson: return
+    prompts = {}
+    prerendered_variants = PRERENDERED_VARIANTS if lesson.course.llm_paraphrase else TEMPLATED_PRERENDERED_VARIANTS
+    compiled = compiled_lesson(lesson)
+    for step_index, step in enumerate(compiled.steps):
+        if step.get('type') == 'MEDIA' and not step.get('media_url'): continue  # chat() skips these
+        step_prompts = [tutor_prompt_for_step(step, variant) for variant in prerendered_variants.get(step.get('type'), ())]
+        if step.get('type') in lesson_engine.QUESTION_TYPES: step_prompts.append(retry_prompt(compiled, step_index))
+        for prompt in step_prompts:
+            prompts[prompt_hash(prompt)] = prompt
+    lesson.tutor_turns.filter(TutorTurn.prompt_hash.notin_(prompts)).delete(synchronize_session=False)
+    db.session.commit()
+    existing = {hash_ for (hash_,) in db.session.query(TutorTurn.prompt_hash).filter_by(lesson_id=lesson_id)}
+    missing = [(hash_, prompt) for hash_, prompt in prompts.items() if hash_ not in existing]
+    # In waves of the gateway's background budget, so a chapter save never crowds out students' calls.
+    for start in range(0, len(missing), llm.max_background):
+        futures = {hash_: llm.submit_background(prompt) for hash_, prompt in missing[start:start + llm.max_background]}
+        for hash_, future in futures.items():
+            try:
+                response_text = llm.result(future)
+            except Exception as e:
+                print(f"Error pre-generating tutor turn: {e}")
+                continue
+            if not response_text: continue
+            db.session.add(TutorTurn(lesson_id=lesson_id, prompt_hash=hash_, text=response_text))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()  # a concurrent pre-generation run stored it first
+
+# --- Media Store ---
+# Uploads are stored under their content hash, so re-uploading a file (every chapter edit does)
+# costs one hash and no disk. Lessons and courses hold MediaRef rows, synced whenever the media
+# they point at changes.
+MEDIA_CHUNK_BYTES = 64 * 1024
+MEDIA_URL_PATTERN = re.compile(r'/uploads/([0-9a-f]{64})\.?[A-Za-z0-9]*$')
+
+def insert_ignoring_conflicts(model, **values):
+    insert = sqlite.insert if db.engine.dialect.name == 'sqlite' else postgresql.insert
+    db.session.execute(insert(model).values(**values).on_conflict_do_nothing())
+
+def media_path(key, extension):
+    return os.path.join(app.config['UPLOAD_FOLDER'], key + extension)
+
+# Hashes the upload while writing it to a temporary file, then moves it into place. Identical
+# bytes land on the same path, so an existing copy is simply replaced by itself.
+def store_media_file(uploaded_file):
+    extension = os.path.splitext(uploaded_file.filename)[1].lower()[:16]
+    temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f".upload-{uuid.uuid4()}")
+    digest, size = hashlib.sha256(), 0
+    try:
+        with open(temp_path, 'wb') as out:
+            while chunk := uploaded_file.stream.read(MEDIA_CHUNK_BYTES):
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        key = digest.hexdigest()
+        insert_ignoring_conflicts(MediaBlob, key=key, extension=extension, size_bytes=size, created_at=datetime.datetime.utcnow())
+        extension = MediaBlob.query.get(key).extension  # the first upload of these bytes named the file
+        os.replace(temp_path, media_path(key, extension))
+    finally:
+        if os.path.exists(temp_path): os.remove(temp_path)
+    return url_for('static', filename=f'uploads/{key}{extension}')
+
+def save_uploaded_media(files):
+    return [store_media_file(uploaded_file) for uploaded_file in files if uploaded_file.filename != '']
+
+def media_key(url):
+    match = MEDIA_URL_PATTERN.search(url or '')
+    return match.group(1) if match else None
+
+def lesson_media_urls(lesson):
+    urls = {step['media_url'] for step in json.loads(lesson.parsed_json).get('steps', []) if step.get('type') == 'MEDIA' and step.get('media_url')}
+    for job in lesson.ingest_jobs.filter(IngestJob.status.in_(('pending', 'running'))):
+        urls.update(json.loads(job.payload_json).get('media_urls', []))
+    return urls
+
+# Makes the owner's references exactly the stored blobs among `urls`, adjusting ref counts.
+def sync_media_refs(owner_type, owner_id, urls):
+    candidate_keys = {key for key in map(media_key, urls) if key}
+    wanted = {key for (key,) in db.session.query(MediaBlob.key).filter(MediaBlob.key.in_(candidate_keys))} if candidate_keys else set()
+    refs = MediaRef.query.filter_by(owner_type=owner_type, owner_id=owner_id).all()
+    held = {ref.blob_key for ref in refs}
+    for ref in refs:
+        if ref.blob_key not in wanted: db.session.delete(ref)
+    for key in wanted - held:
+        db.session.add(MediaRef(blob_key=key, owner_type=owner_type, owner_id=owner_id))
+    if wanted - held:
+        MediaBlob.query.filter(MediaBlob.key.in_(wanted - held)).update({'ref_count': MediaBlob.ref_count + 1}, synchronize_session=False)
+    if held - wanted:
+        MediaBlob.query.filter(MediaBlob.key.in_(held - wanted)).update(
+            {'ref_count': MediaBlob.ref_count - 1, 'released_at': datetime.datetime.utcnow()}, synchronize_session=False)
+
+# --- Media Variants ---
+# Ingest workers resize stored images into MEDIA_VARIANT_WIDTHS WebP copies after upload, so no
+# request waits on Pillow. Pages ask responsive_image() for a src/srcset pair and fall back to
+# the original until the variants exist.
+MEDIA_FILE_PATTERN = re.compile(r'uploads/[0-9a-f]{64}(-\d+\.webp|\.[A-Za-z0-9]+)?$')
+MEDIA_VARIANT_CACHE_SIZE = 4096
+media_variant_cache = OrderedDict()  # blob key -> (width, variant widths), only for finished blobs
+media_variant_cache_lock = threading.Lock()
+
+def requeue_stale_media_variants():
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=app.config['INGEST_JOB_TIMEOUT'])
+    MediaBlob.query.filter(MediaBlob.variant_status == 'running', MediaBlob.variant_started_at < stale_before).update({'variant_status': 'pending'}, synchronize_session=False)
+    db.session.commit()
+
+# Claimed with a conditional UPDATE, like ingest jobs. Returns (key, extension) or None.
+def claim_media_variants():
+    candidate = db.session.query(MediaBlob.key, MediaBlob.extension).filter_by(variant_status='pending').order_by(MediaBlob.created_at).first()
+    if not candidate:
+        db.session.rollback()
+        return None
+    claimed = MediaBlob.query.filter_by(key=candidate.key, variant_status='pending').update(
+        {'variant_status': 'running', 'variant_started_at': datetime.datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return (candidate.key, candidate.extension) if claimed else None
+
+def run_media_variants(key, extension):
+    width, widths = media_variants.generate(media_path(key, extension), app.config['UPLOAD_FOLDER'], key, app.config['MEDIA_VARIANT_WIDTHS'])
+    # A blob collected by media-gc meanwhile simply matches no row here.
+    MediaBlob.query.filter_by(key=key).update({'width': width, 'variant_widths_json': json.dumps(widths), 'variant_status': 'done'}, synchronize_session=False)
+    db.session.commit()
+
+def media_variant_info(urls):
+    keys = {key for key in map(media_key, urls) if key}
+    found = {}
+    with media_variant_cache_lock:
+        for key in keys & media_variant_cache.keys():
+            media_variant_cache.move_to_end(key)
+            found[key] = media_variant_cache[key]
+    missing = keys - found.keys()
+    if missing:
+        rows = db.session.query(MediaBlob.key, MediaBlob.width, MediaBlob.variant_widths_json).filter(MediaBlob.key.in_(missing), MediaBlob.variant_status == 'done').all()
+        with media_variant_cache_lock:
+            for key, width, widths_json in rows:
+                found[key] = media_variant_cache[key] = (width, json.loads(widths_json))
+            while len(media_variant_cache) > MEDIA_VARIANT_CACHE_SIZE:
+                media_variant_cache.popitem(last=False)
+    return found
+
+# src and srcset for an image shown about `display_width` CSS pixels wide. src is the smallest
+# copy at least that wide; without variants it is the original url and srcset is empty.
+@app.template_global()
+def responsive_image(url, display_width, variant_info=None):
+    key = media_key(url)
+    if variant_info is None: variant_info = media_variant_info([url])
+    width, widths = variant_info.get(key, (None, []))
+    if not widths: return {'src': url, 'srcset': ''}
+    folder = url.rsplit('/', 1)[0]
+    candidates = [(f"{folder}/{media_variants.variant_name(key, w)}", w) for w in widths] + [(url, width)]
+    src = next((candidate for candidate, w in candidates if w >= display_width), url)
+    return {'src': src, 'srcset': ', '.join(f"{candidate} {w}w" for candidate, w in candidates)}
+
+# Stored media and its variants are named by their content, so browsers can keep them for good.
+@app.after_request
+def cache_stored_media(response):
+    if request.endpoint == 'static' and MEDIA_FILE_PATTERN.match((request.view_args or {}).get('filename', '')):
+        response.cache_control.public = True
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = app.config['MEDIA_CACHE_MAX_AGE']
+        response.cache_control.immutable = True
+    return response
+
+# --- Catalog Search ---
+# course_search is an FTS5 table (SQLite only, created by migration) over each course's title,
+# description and lesson titles. It is refreshed explicitly wherever those change.
+def refresh_course_search(course_id):
+    if db.engine.dialect.name != 'sqlite': return
+    db.session.execute(db.text("DELETE FROM course_search WHERE course_id = :course_id"), {'course_id': course_id})
+    db.session.execute(db.text(
+        "INSERT INTO course_search (course_id, title, description, lesson_titles) "
+        "SELECT c.id, c.title, COALESCE(c.description, ''), "
+        "COALESCE((SELECT group_concat(l.title, ' ') FROM lesson l WHERE l.course_id = c.id), '') "
+        "FROM course c WHERE c.id = :course_id"), {'course_id': course_id})
+
+def course_search_ids(search_text):
+    if db.engine.dialect.name == 'sqlite':
+        # Quote each word so FTS5 syntax in user input is taken literally; the * allows prefix matches.
+        terms = ' '.join(f'"{word}"*' for word in (w.replace('"', '') for w in search_text.split()) if word)
+        matches = db.text("SELECT course_id FROM course_search WHERE course_search MATCH :terms").bindparams(terms=terms).columns(course_id=db.String).subquery()
+        return db.select(matches.c.course_id)
+    pattern = f"%{search_text}%"
+    return db.select(Course.id).outerjoin(Lesson).where(db.or_(Course.title.ilike(pattern), Course.description.ilike(pattern), Lesson.title.ilike(pattern)))
+
+def encode_catalog_cursor(course):
+    return base64.urlsafe_b64encode(json.dumps([course.title, course.id]).encode('utf-8')).decode('ascii')
+
+def decode_catalog_cursor(cursor):
+    try:
+        title, course_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(title), str(course_id)
+    except (ValueError, TypeError):
+        return None
+
+# Keyset pagination on (title, id), served by ix_course_published_title_id, so every page costs
+# the same no matter how deep into the catalog it is. Returns (courses, next_cursor).
+def published_courses_page(search_text=None, after=None, limit=None):
+    limit = limit or app.config['EXPLORE_PAGE_SIZE']
+    query = Course.query.options(db.joinedload(Course.creator)).filter(Course.is_published == True)
+    if search_text and search_text.replace('"', '').strip():
+        query = query.filter(Course.id.in_(course_search_ids(search_text)))
+    position = decode_catalog_cursor(after) if after else None
+    if position:
+        query = query.filter(db.tuple_(Course.title, Course.id) > position)
+    courses = query.order_by(Course.title, Course.id).limit(limit + 1).all()
+    next_cursor = encode_catalog_cursor(courses[limit - 1]) if len(courses) > limit else None
+    return courses[:limit], next_cursor
+
+# --- Ingestion Jobs ---
+INGEST_MAX_ATTEMPTS = 3
+
+def enqueue_ingest_job(lesson, media_urls, media_positions=(), kept_urls=None):
+    lesson.status = 'pending'
+    job = IngestJob(lesson=lesson, payload_json=json.dumps({'media_urls': media_urls, 'media_positions': list(media_positions), 'media_kept': kept_urls}))
+    db.session.add(job)
+    db.session.flush()
+    sync_media_refs('lesson', lesson.id, lesson_media_urls(lesson))
+    return job
+
+# Jobs whose worker died mid-run go back to the queue once they exceed INGEST_JOB_TIMEOUT.
+def requeue_stale_ingest_jobs():
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=app.config['INGEST_JOB_TIMEOUT'])
+    IngestJob.query.filter(IngestJob.status == 'running', IngestJob.started_at < stale_before).update({'status': 'pending'}, synchronize_session=False)
+    db.session.commit()
+
+# The conditional UPDATE is the lock: only one worker sees a rowcount of 1 for a given job.
+def claim_ingest_job():
+    candidate = db.session.query(IngestJob.id).filter_by(status='pending').order_by(IngestJob.created_at).first()
+    if not candidate:
+        db.session.rollback()
+        return None
+    claimed = IngestJob.query.filter_by(id=candidate.id, status='pending').update(
+        {'status': 'running', 'started_at': datetime.datetime.utcnow(), 'attempts': IngestJob.attempts + 1}, synchronize_session=False)
+    db.session.commit()
+    return IngestJob.query.get(candidate.id) if claimed else None
+
+# Jobs that only pre-generate tutor turns leave the lesson's status to the jobs that parse it.
+def is_pregenerate_only(job):
+    return bool(json.loads(job.payload_json).get('pregenerate_only'))
+
+def finish_ingest_job(job, status, error=None):
+    job.status = status
+    job.error = error
+    job.finished_at = datetime.datetime.utcnow()
+    if job.lesson and not is_pregenerate_only(job):
+        job.lesson.status = 'parsed' if status == 'done' else 'failed'
+        sync_media_refs('lesson', job.lesson_id, lesson_media_urls(job.lesson))  # drops uploads the new version did not use
+    db.session.commit()
+
+def run_ingest_job(job):
+    if job.attempts > INGEST_MAX_ATTEMPTS:
+        finish_ingest_job(job, 'failed', 'Gave up after repeated worker failures.')
+        return
+    lesson = job.lesson
+    if not lesson: return
+    if is_pregenerate_only(job):
+        finish_ingest_job(job, 'done')
+        pregenerate_tutor_turns(lesson.id)
+        return
+    try:
+        parsed_data = parse_script_incrementally(lesson.raw_script)
+        if not parsed_data:
+            db.session.rollback()
+            finish_ingest_job(job, 'failed', 'The AI could not understand the lesson structure. Please check your tags and try again.')
+            return
+        payload = json.loads(job.payload_json)
+        bind_media_urls(parsed_data['steps'], payload.get('media_urls', []), previous_steps=json.loads(lesson.parsed_json).get('steps', []),
+                        media_positions=payload.get('media_positions', []), kept_urls=payload.get('media_kept'))
+        lesson.parsed_json = json.dumps(parsed_data)
+        lesson.version = Lesson.version + 1
+        lesson.qna_answers.delete(synchronize_session=False)
+        finish_ingest_job(job, 'done')
+    except Exception as e:
+        print(f"Error running ingest job {job.id}: {e}")
+        db.session.rollback()
+        finish_ingest_job(job, 'failed', 'Something went wrong while processing this chapter. Please try saving it again.')
+        return
+    pregenerate_tutor_turns(lesson.id)
+
+def run_ingest_worker(stop_event=None):
+    last_requeue = 0
+    while not (stop_event and stop_event.is_set()):
+        with app.app_context():
+            try:
+                if time.monotonic() - last_requeue > 60:
+                    requeue_stale_ingest_jobs()
+                    requeue_stale_media_variants()
+                    last_requeue = time.monotonic()
+                job = claim_ingest_job()
+                if job:
+                    run_ingest_job(job)
+                    continue
+                # Chapters first; resizing images only fills otherwise idle polls.
+                blob = media_variants.available() and claim_media_variants()
+                if blob:
+                    run_media_variants(*blob)
+                    continue
+            except Exception as e:
+                print(f"Error in ingest worker: {e}")
+                db.session.rollback()
+        time.sleep(app.config['INGEST_POLL_INTERVAL'])
+
+# --- Bulk Import ---
+# An import archive is a .zip of chapter scripts (.txt/.md) plus media. Without a course.json
+# manifest, top-level scripts become chapters in natural filename order ("2-x" before "10-y"),
+# and the files in a folder named after a script are bound to its MEDIA steps in order.
+SCRIPT_EXTENSIONS = ('.txt', '.md')
+
+def natural_key(name):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def chapter_title_from_filename(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r'^\d+[\s._-]*', '', stem).replace('_', ' ').replace('-', ' ').strip() or stem
+
+def read_import_manifest(archive):
+    names = [name for name in archive.namelist() if not name.endswith('/') and not name.startswith('__MACOSX/')]
+    # Archives made by zipping a folder put everything under that folder; treat it as the root.
+    top_level = {name.split('/', 1)[0] for name in names}
+    root = top_level.pop() + '/' if len(top_level) == 1 and all('/' in name for name in names) else ''
+    if root + 'course.json' in names:
+        manifest = json.loads(archive.read(root + 'course.json'))
+        return [{'title': chapter['title'], 'script': root + chapter['script'], 'media': [root + m for m in chapter.get('media', [])]} for chapter in manifest['chapters']]
+    chapters = []
+    scripts = [name for name in names if name.startswith(root) and '/' not in name[len(root):] and name.lower().endswith(SCRIPT_EXTENSIONS)]
+    for name in sorted(scripts, key=natural_key):
+        media_dir = os.path.splitext(name)[0] + '/'
+        media = sorted((n for n in names if n.startswith(media_dir)), key=natural_key)
+        chapters.append({'title': chapter_title_from_filename(name), 'script': name, 'media': media})
+    return chapters
+
+# Parses every chapter concurrently, then adds them all in one transaction. Nothing is written
+# (not even media) unless every chapter parses. Returns (lessons, errors).
+def import_course_archive(course, archive_file):
+    with zipfile.ZipFile(archive_file) as archive:
+        try:
+            chapters = read_import_manifest(archive)
+            scripts = [archive.read(chapter['script']).decode('utf-8', errors='replace') for chapter in chapters]
+        except (KeyError, ValueError, TypeError) as e:  # TypeError: a manifest of the wrong shape
+            return [], [f"The archive does not match its course.json manifest: {e}"]
+        if not chapters:
+            return [], ['The archive has no chapter scripts (.txt or .md files).']
+
+        # parse_lesson_script never touches the database, so it is safe to fan out over threads.
+        with ThreadPoolExecutor(max_workers=app.config['LLM_MAX_WORKERS']) as pool:
+            parsed_chapters = list(pool.map(parse_lesson_script, scripts))
+        errors = [f"{chapter['script']}: the lesson structure could not be understood." for chapter, parsed_data in zip(chapters, parsed_chapters) if not parsed_data]
+        if errors: return [], errors
+
+        last_chapter_number = db.session.query(db.func.max(Lesson.chapter_number)).filter(Lesson.course_id == course.id).scalar() or 0
+        lessons = []
+        for offset, (chapter, script, parsed_data) in enumerate(zip(chapters, scripts, parsed_chapters), start=1):
+            media_urls = save_uploaded_media(FileStorage(stream=io.BytesIO(archive.read(name)), filename=name) for name in chapter['media'])
+            bind_media_urls(parsed_data['steps'], media_urls)
+            lesson = Lesson(title=chapter['title'], raw_script=script, parsed_json=json.dumps(parsed_data), course_id=course.id, chapter_number=last_chapter_number + offset)
+            refresh_lesson_search_index(lesson)
+            db.session.add(lesson)
+            db.session.add(IngestJob(lesson=lesson, payload_json=json.dumps({'pregenerate_only': True})))
+            db.session.flush()
+            sync_media_refs('lesson', lesson.id, lesson_media_urls(lesson))
+            lessons.append(lesson)
+        course.lesson_count = Course.lesson_count + len(lessons)
+        refresh_course_search(course.id)
+        db.session.commit()
+    return lessons, []
+
+ingest_threads_started = False
+ingest_threads_lock = threading.Lock()
+
+# Web processes run INGEST_WORKER_THREADS in-process workers, started on the first request so
+# that CLI commands such as `flask db upgrade` never start them. Set it to 0 when running
+# dedicated `flask ingest-worker` processes instead.
+@app.before_request
+def start_ingest_threads():
+    global ingest_threads_started
+    if ingest_threads_started: return
+    with ingest_threads_lock:
+        if ingest_threads_started: return
+        for _ in range(app.config['INGEST_WORKER_THREADS']):
+            threading.Thread(target=run_ingest_worker, daemon=True).start()
+        ingest_threads_started = True
 
 # --- Auth Routes ---
 @app.route('/register', methods=['GET', 'POST'])
@@ -214,14 +1050,16 @@ def index():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    enrollments = Enrollment.query.filter_by(user_id=current_user.id).join(Course).order_by(Course.title).all()
+    # One query however many courses: each enrollment carries its progress, and lesson_count is kept on the course.
+    enrollments = Enrollment.query.filter_by(user_id=current_user.id).join(Course).options(
+        db.contains_eager(Enrollment.course).joinedload(Course.creator)).order_by(Course.title).all()
     return render_template('dashboard.html', enrollments=enrollments)
 
 @app.route('/creator')
 @login_required
 def creator_dashboard():
     created_courses = Course.query.filter_by(user_id=current_user.id).order_by(Course.title).all()
-    return render_template('creator_dashboard.html', created_courses=created_courses)
+    return render_template('creator_dashboard.html', created_courses=created_courses, course_stats=creator_analytics.course_stats([course.id for course in created_courses]))
 
 # --- Course & Chapter Management ---
 @app.route('/create_course', methods=['POST'])
@@ -233,6 +1071,8 @@ def create_course():
         return redirect(url_for('creator_dashboard'))
     new_course = Course(title=title, user_id=current_user.id)
     db.session.add(new_course)
+    db.session.flush()
+    refresh_course_search(new_course.id)
     db.session.commit()
     flash('Course created! You can now manage its chapters.', 'success')
     return redirect(url_for('manage_course', course_id=new_course.id))
@@ -242,7 +1082,8 @@ def create_course():
 def manage_course(course_id):
     course = Course.query.get_or_404(course_id)
     if course.creator.id != current_user.id: abort(403)
-    return render_template('manage_course.html', course=course)
+    return render_template('manage_course.html', course=course, stats=creator_analytics.course_stats([course.id]).get(course.id),
+                           funnel=creator_analytics.completion_funnel(course), question_accuracy=creator_analytics.question_accuracy(course.id))
 
 @app.route('/course/<string:course_id>/publish', methods=['POST'])
 @login_required
@@ -276,34 +1117,45 @@ def save_chapter(course_id):
         flash('Both a title and script are required.', 'warning')
         return redirect(url_for('add_chapter_page', course_id=course.id))
 
-    files = request.files.getlist('media')
-    media_urls = []
-    for uploaded_file in files:
-        if uploaded_file.filename != '':
-            filename = str(uuid.uuid4()) + os.path.splitext(uploaded_file.filename)[1]
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            uploaded_file.save(filepath)
-            media_urls.append(url_for('static', filename=f'uploads/{filename}'))
-
-    parsed_data = parse_lesson_script(script)
-    if not parsed_data:
-        flash('The AI could not understand the lesson structure. Please check your tags and try again.', 'danger')
-        return redirect(url_for('add_chapter_page', course_id=course.id))
-
-    media_url_iterator = iter(media_urls)
-    for step in parsed_data.get('steps', []):
-        if step.get('type') == 'MEDIA':
-            try: step['media_url'] = next(media_url_iterator)
-            except StopIteration: break
+    media_urls = save_uploaded_media(request.files.getlist('media'))
 
     last_chapter = Lesson.query.filter_by(course_id=course.id).order_by(Lesson.chapter_number.desc()).first()
     new_chapter_number = (last_chapter.chapter_number + 1) if last_chapter else 1
 
-    new_lesson = Lesson(title=title, raw_script=script, parsed_json=json.dumps(parsed_data), course_id=course.id, chapter_number=new_chapter_number)
+    new_lesson = Lesson(title=title, raw_script=script, parsed_json=EMPTY_LESSON_JSON, course_id=course.id, chapter_number=new_chapter_number)
+    refresh_lesson_search_index(new_lesson)
     db.session.add(new_lesson)
+    course.lesson_count = Course.lesson_count + 1
+    refresh_course_search(course.id)
+    job = enqueue_ingest_job(new_lesson, media_urls, media_positions_from_form())
     db.session.commit()
 
-    flash('Chapter added successfully!', 'success')
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job.id, 'lesson_id': new_lesson.id, 'status_url': url_for('ingest_job_status', job_id=job.id)}), 202
+    flash('Chapter saved! It will be ready as soon as processing finishes.', 'success')
+    return redirect(url_for('manage_course', course_id=course.id))
+
+@app.route('/course/<string:course_id>/import', methods=['POST'])
+@login_required
+def import_chapters(course_id):
+    course = Course.query.get_or_404(course_id)
+    if course.creator.id != current_user.id: abort(403)
+
+    archive = request.files.get('archive')
+    if not archive or archive.filename == '':
+        lessons, errors = [], ['Choose a .zip archive to import.']
+    else:
+        try:
+            lessons, errors = import_course_archive(course, archive.stream)
+        except zipfile.BadZipFile:
+            lessons, errors = [], ['That file is not a valid .zip archive.']
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'success': not errors, 'errors': errors, 'lesson_ids': [lesson.id for lesson in lessons]}), (400 if errors else 201)
+    if errors:
+        flash('Import failed: ' + ' '.join(errors), 'danger')
+    else:
+        flash(f'Imported {len(lessons)} chapter(s)!', 'success')
     return redirect(url_for('manage_course', course_id=course.id))
 
 @app.route('/edit_chapter/<string:lesson_id>', methods=['GET'])
@@ -311,7 +1163,7 @@ def save_chapter(course_id):
 def edit_chapter_page(lesson_id):
     lesson = Lesson.query.get_or_404(lesson_id)
     if lesson.course.creator.id != current_user.id: abort(403)
-    return render_template('edit_chapter.html', lesson=lesson)
+    return render_template('edit_chapter.html', lesson=lesson, media_urls=media_step_urls(lesson))
 
 @app.route('/update_chapter/<string:lesson_id>', methods=['POST'])
 @login_required
@@ -321,33 +1173,25 @@ def update_chapter(lesson_id):
 
     lesson.title = request.form['title']
     lesson.raw_script = request.form['script']
+    refresh_lesson_search_index(lesson)
 
-    files = request.files.getlist('media')
-    media_urls = []
-    for uploaded_file in files:
-        if uploaded_file.filename != '':
-            filename = str(uuid.uuid4()) + os.path.splitext(uploaded_file.filename)[1]
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            uploaded_file.save(filepath)
-            media_urls.append(url_for('static', filename=f'uploads/{filename}'))
-
-    parsed_data = parse_lesson_script(lesson.raw_script)
-    if not parsed_data:
-        flash('The AI could not understand the lesson structure.', 'danger')
-        return redirect(url_for('edit_chapter_page', lesson_id=lesson.id))
-
-    media_url_iterator = iter(media_urls)
-    for step in parsed_data.get('steps', []):
-        if step.get('type') == 'MEDIA':
-            try: step['media_url'] = next(media_url_iterator)
-            except StopIteration: break
-
-    lesson.parsed_json = json.dumps(parsed_data)
+    media_urls = save_uploaded_media(request.files.getlist('media'))
+    refresh_course_search(lesson.course_id)
+    job = enqueue_ingest_job(lesson, media_urls, media_positions_from_form(), kept_media_urls_from_form())
     db.session.commit()
 
-    flash('Chapter updated successfully!', 'success')
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job.id, 'lesson_id': lesson.id, 'status_url': url_for('ingest_job_status', job_id=job.id)}), 202
+    flash('Chapter updated! Students will see the new version once processing finishes.', 'success')
     return redirect(url_for('manage_course', course_id=lesson.course_id))
 
+@app.route('/jobs/<string:job_id>')
+@login_required
+def ingest_job_status(job_id):
+    job = IngestJob.query.get_or_404(job_id)
+    if job.lesson.course.creator.id != current_user.id: abort(403)
+    return jsonify({'id': job.id, 'status': job.status, 'lesson_id': job.lesson_id, 'chapter_status': job.lesson.status, 'error': job.error})
+
 @app.route('/delete_chapter/<string:lesson_id>', methods=['POST'])
 @login_required
 def delete_chapter(lesson_id):
@@ -355,9 +1199,18 @@ def delete_chapter(lesson_id):
     if lesson.course.creator.id != current_user.id: abort(403)
     course_id = lesson.course_id
     deleted_chapter_number = lesson.chapter_number
+    lesson.course.lesson_count = Course.lesson_count - 1
+    forget_compiled_lesson(lesson.id)
+    sync_media_refs('lesson', lesson.id, ())
+    # Conversations have no ORM cascade from Lesson (PostgreSQL would reject the delete). Going
+    # through the course's enrollments lets both deletes use their (enrollment_id, lesson_id) keys.
+    course_enrollments = db.select(Enrollment.id).filter_by(course_id=course_id)
+    ChatTurn.query.filter(ChatTurn.enrollment_id.in_(course_enrollments), ChatTurn.lesson_id == lesson.id).delete(synchronize_session=False)
+    ChatHistory.query.filter(ChatHistory.enrollment_id.in_(course_enrollments), ChatHistory.lesson_id == lesson.id).delete(synchronize_session=False)
     db.session.delete(lesson)
     subsequent_chapters = Lesson.query.filter(Lesson.course_id == course_id, Lesson.chapter_number > deleted_chapter_number).order_by(Lesson.chapter_number).all()
     for chapter in subsequent_chapters: chapter.chapter_number -= 1
+    refresh_course_search(course_id)
     db.session.commit()
     flash('Chapter deleted successfully.', 'success')
     return redirect(url_for('manage_course', course_id=course_id))
@@ -378,19 +1231,40 @@ def reorder_chapters(course_id):
 # --- Student-Facing Routes ---
 @app.route('/explore')
 def explore():
-    courses = Course.query.filter_by(is_published=True).order_by(Course.title).all()
-    return render_template('explore.html', courses=courses)
+    search_text = request.args.get('q', '').strip()
+    courses, next_cursor = published_courses_page(search_text, request.args.get('after'))
+    thumbnail_variants = media_variant_info(course.thumbnail_url for course in courses)
+    return render_template('explore.html', courses=courses, next_cursor=next_cursor, search_text=search_text, thumbnail_variants=thumbnail_variants)
+
+@app.route('/api/courses')
+def catalog_api():
+    limit = max(1, min(request.args.get('limit', app.config['EXPLORE_PAGE_SIZE'], type=int), 100))
+    courses, next_cursor = published_courses_page(request.args.get('q', '').strip(), request.args.get('after'), limit)
+    return jsonify({
+        'courses': [{
+            'id': course.id,
+            'title': course.title,
+            'description': course.description,
+            'thumbnail_url': course.thumbnail_url,
+            'creator': course.creator.username,
+            'lesson_count': course.lesson_count,
+            'review_count': course.review_count,
+            'average_rating': course.average_rating,
+            'url': url_for('course_detail_page', course_id=course.id),
+        } for course in courses],
+        'next_cursor': next_cursor,
+    })
 
 @app.route('/course/<string:course_id>')
 @login_required
 def course_player(course_id):
     course = Course.query.get_or_404(course_id)
     is_public = course.is_published
-    is_creator = (course.creator.id == current_user.id)
+    is_creator = (course.user_id == current_user.id)
     is_enrolled = current_user.is_enrolled(course)
     if not (is_public or is_creator or is_enrolled):
         abort(404)
-    if not course.lessons:
+    if not course.lesson_count:
         if current_user.is_authenticated and current_user.id == course.user_id:
             flash('This course has no chapters yet. Add one to enable the preview.', 'info')
             return redirect(url_for('manage_course', course_id=course.id))
@@ -399,213 +1273,574 @@ def course_player(course_id):
     enrollment = Enrollment.query.filter_by(user_id=current_user.id, course_id=course.id).first()
     chapter_to_start = 1
     if enrollment:
-        chapter_to_start = enrollment.last_completed_chapter_number + 1
-        if chapter_to_start > len(course.lessons): chapter_to_start = len(course.lessons)
+        # The first playable chapter not completed yet, or the last one once they all are.
+        playable = playable_chapter_numbers(course.id)
+        last_completed = enrollment.last_completed_chapter_number
+        chapter_to_start = min((n for n in playable if n > last_completed), default=max(playable, default=course.lesson_count))
     return redirect(url_for('student_chapter_view', course_id=course.id, chapter_number=chapter_to_start))
 
 @app.route('/course/<string:course_id>/<int:chapter_number>')
 @login_required
 def student_chapter_view(course_id, chapter_number):
-    course = Course.query.get_or_404(course_id)
-    if not (course.is_published or course.user_id == current_user.id or current_user.is_enrolled(course)):
+    context = load_lesson_context(course_id=course_id, chapter_number=chapter_number)
+    if not context: abort(404)
+    lesson, course, enrollment, chat_history_record = context
+    if not (course.is_published or course.user_id == current_user.id or enrollment):
         abort(404)
     
-    lesson = Lesson.query.filter_by(course_id=course.id, chapter_number=chapter_number).first_or_404()
-    
-    enrollment = Enrollment.query.filter_by(user_id=current_user.id, course_id=course.id).first()
+    if not lesson.is_playable:
+        flash('This chapter is still being prepared. Please check back shortly.', 'info')
+        return redirect(url_for('manage_course', course_id=course.id) if course.user_id == current_user.id else url_for('dashboard'))
     
     initial_history_data = None  # Default to None
+    initial_turns = []
 
     if enrollment:
-        # We are dealing with an enrolled student, try to find their history
-        chat_history_record = ChatHistory.query.filter_by(
-            enrollment_id=enrollment.id, 
-            lesson_id=lesson.id
-        ).first()
-
         # THE FIX: Create a simple dictionary instead of passing the whole object
         if chat_history_record:
             initial_history_data = {
-                "history_json": chat_history_record.history_json,
+                "history": chat_history_record.messages(),
                 "current_step_index": chat_history_record.current_step_index
             }
         # If no record, initial_history_data remains None, which is fine
+        if not (initial_history_data and (initial_history_data['history'] or initial_history_data['current_step_index'])):
+            # A fresh start: ship the opening turns with the page instead of a first /chat/advance.
+            opening = chapter_opening(lesson)
+            if opening:
+                try:
+                    initial_turns = start_chapter_from_opening(lesson, enrollment, chat_history_record, opening)
+                except IntegrityError:
+                    # A concurrent first load of this chapter saved its opening first; show that one.
+                    db.session.rollback()
+                    chat_history_record = ChatHistory.query.filter_by(enrollment_id=enrollment.id, lesson_id=lesson.id).first()
+                    initial_history_data = {
+                        "history": chat_history_record.messages(),
+                        "current_step_index": chat_history_record.current_step_index
+                    }
 
     # Note: If there's no enrollment (e.g., a creator previewing), 
     # initial_history_data will correctly be None.
 
+    # The sidebar only needs each chapter's number and title, not its script.
+    chapters = Lesson.query.options(db.load_only(Lesson.id, Lesson.title, Lesson.chapter_number)).filter_by(course_id=course.id).order_by(Lesson.chapter_number).all()
+
     return render_template(
         'course_player.html', 
         course=course, 
+        chapters=chapters,
         current_lesson=lesson, 
         enrollment=enrollment, 
-        initial_history=initial_history_data
+        initial_history=initial_history_data,
+        initial_turns=initial_turns
     )
 
-# --- CHAT ROUTE (REWRITTEN FOR STATEFUL CONVERSATIONS) ---
-# --- CHAT ROUTE (CORRECTED AND REFACTORED) ---
-@app.route('/chat', methods=['POST'])
-@login_required
-def chat():
-    data = request.json
-    lesson_id = data['lesson_id']
-    lesson = Lesson.query.get_or_404(lesson_id)
-    lesson_data = json.loads(lesson.parsed_json)
+def playable_chapter_numbers(course_id):
+    return [number for (number,) in db.session.query(Lesson.chapter_number).filter(
+        Lesson.course_id == course_id, Lesson.is_playable).order_by(Lesson.chapter_number)]
+
+# --- Compiled Lessons ---
+# lesson_engine.CompiledLesson instances, kept per process in LRU order and rebuilt when the
+# lesson's version moves on.
+compiled_lessons = OrderedDict()
+compiled_lessons_lock = threading.Lock()
+
+# Other processes notice an edit through Lesson.version; forgetting here only frees memory early.
+def forget_compiled_lesson(lesson_id):
+    with compiled_lessons_lock:
+        compiled_lessons.pop(lesson_id, None)
+
+def compiled_lesson(lesson):
+    with compiled_lessons_lock:
+        compiled = compiled_lessons.get(lesson.id)
+        if compiled and compiled.version == lesson.version:
+            compiled_lessons.move_to_end(lesson.id)
+            return compiled
+    compiled = lesson_engine.CompiledLesson(lesson.id, lesson.version, json.loads(lesson.parsed_json).get('steps', []))
+    with compiled_lessons_lock:
+        compiled_lessons[lesson.id] = compiled
+        compiled_lessons.move_to_end(lesson.id)
+        while len(compiled_lessons) > app.config['COMPILED_LESSON_CACHE_SIZE']:
+            compiled_lessons.popitem(last=False)
+    return compiled
+
+# --- Request Context ---
+# The lesson, its course, the current user's enrollment and their chat state in one joined query,
+# kept on `g` for the rest of the request. Returns (lesson, course, enrollment, history_record),
+# where the last two may be None, or None if there is no such lesson. The script and parsed steps
+# are deferred: only the compiled lesson (on a cache miss) or a QNA prompt loads them.
+def load_lesson_context(lesson_id=None, course_id=None, chapter_number=None):
+    key = (lesson_id, course_id, chapter_number)
+    contexts = g.setdefault('lesson_contexts', {})
+    if key not in contexts:
+        user_id = current_user.id if current_user.is_authenticated else None
+        query = (db.session.query(Lesson, Course, Enrollment, ChatHistory)
+                 .join(Course, Lesson.course_id == Course.id)
+                 .outerjoin(Enrollment, db.and_(Enrollment.course_id == Course.id, Enrollment.user_id == user_id))
+                 .outerjoin(ChatHistory, db.and_(ChatHistory.enrollment_id == Enrollment.id, ChatHistory.lesson_id == Lesson.id))
+                 .options(db.defer(Lesson.raw_script), db.defer(Lesson.parsed_json)))
+        if lesson_id: query = query.filter(Lesson.id == lesson_id)
+        else: query = query.filter(Lesson.course_id == course_id, Lesson.chapter_number == chapter_number)
+        contexts[key] = query.first()
+    return contexts[key]
 
-    user_input = data.get('user_input')
-    request_type = data.get('request_type', 'LESSON_FLOW')
-
-    enrollment = Enrollment.query.filter_by(user_id=current_user.id, course_id=lesson.course_id).first()
+# --- CHAT ROUTE (REWRITTEN FOR STATEFUL CONVERSATIONS) ---
+def load_chat_state(data):
+    context = load_lesson_context(lesson_id=data['lesson_id'])
+    if not context: abort(404)
+    lesson, course, enrollment, history_record = context
     if not enrollment:
         abort(403, "User must be enrolled to chat.")
-
-    # FIX: Replace .one_or_create() with the correct SQLAlchemy pattern
-    history_record = ChatHistory.query.filter_by(
-        enrollment_id=enrollment.id, lesson_id=lesson.id
-    ).first()
     if not history_record:
         history_record = ChatHistory(enrollment_id=enrollment.id, lesson_id=lesson.id)
         db.session.add(history_record)
         # We commit here to ensure the record has an ID for subsequent operations if needed
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # a concurrent first turn created it
+            history_record = ChatHistory.query.filter_by(enrollment_id=enrollment.id, lesson_id=lesson.id).one()
+    return lesson, compiled_lesson(lesson), history_record
+
+# --- QNA Context ---
+# Questions are answered from the chunks of the script that match them (see lesson_search) plus a
+# rolling summary of the conversation, both kept within a token budget.
+SUMMARY_LINE_CHARS = 160
+SUMMARY_REBUILD_TURNS = 20
+
+def refresh_lesson_search_index(lesson):
+    index = lesson_search.build_index(lesson.raw_script, app.config['SEARCH_CHUNK_TOKENS'])
+    lesson.search_index_json = json.dumps(index)
+    return index
+
+def qna_prompt(lesson, conversation_summary, question):
+    index = json.loads(lesson.search_index_json) if lesson.search_index_json else None
+    if not lesson_search.is_current(index, lesson.raw_script):
+        index = refresh_lesson_search_index(lesson)
+    excerpts = lesson_search.select_context(index, lesson.raw_script, question, app.config['QNA_CONTEXT_TOKENS'], k=app.config['QNA_TOP_K'])
+    return TUTOR_PROMPT_TEMPLATE['QNA'].format(lesson_script=excerpts, conversation_summary=conversation_summary or '(This is the first message.)', user_question=question)
+
+# --- Short-Answer Grading ---
+def grade_verdict_key(step, user_input):
+    material = json.dumps([GRADER_PROMPT_VERSION, step.get('question'), step.get('keywords', []), grading.normalize(user_input)])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+# Clear answers are graded locally; only the ambiguous middle costs a model call, and that
+# verdict is stored so the same answer to the same step is never sent twice.
+def grade_short_answer(step, user_input):
+    keywords = step.get('keywords', [])
+    is_correct, coverage = grading.grade(user_input, keywords, app.config['SA_GRADER_ACCEPT_AT'], app.config['SA_GRADER_REJECT_BELOW'])
+    if is_correct is not None: return is_correct
+    key = grade_verdict_key(step, user_input)
+    verdict = GradeVerdict.query.get(key)
+    if verdict:
+        verdict.hit_count += 1
+        return verdict.is_correct
+    try:
+        is_correct = generate_text(GRADER_PROMPT.format(", ".join(keywords), user_input)).strip().upper().startswith('CORRECT')
+    except Exception as e:
+        print(f"Error grading short answer, using the local score: {e}")
+        return coverage >= 0.5
+    db.session.add(GradeVerdict(key=key, is_correct=is_correct))
+    try:
         db.session.commit()
-
-    step_index = history_record.current_step_index
-    chat_history = json.loads(history_record.history_json)
-
-    if user_input:
-        chat_history.append({'role': 'user', 'parts': [{'text': user_input}]})
-
-    response_data = {}
-    model_response_text = None
-
+    except IntegrityError:
+        db.session.rollback()  # the same answer was graded concurrently
+    return is_correct
+
+# --- QNA Answer Cache ---
+def qna_question_key(question):
+    return ' '.join(lesson_search.WORD_PATTERN.findall((question or '').lower()))[:500]
+
+def lesson_qna_version(lesson):
+    return hashlib.sha256(f"{lesson.version}\0{lesson.raw_script}".encode('utf-8')).hexdigest()[:16]
+
+# A question's content terms plus its question words, in order: "why" and "how", or the two sides
+# of "bigger than", are what tell otherwise identical questions apart. So does a negation, which
+# is why questions that differ in one never match.
+QUESTION_WORDS = frozenset('what when where which who whom whose why how'.split())
+
+def question_terms(key):
+    return [term for word in key.split() for term in (lesson_search.tokenize(word) or ([word] if word in QUESTION_WORDS else []))]
+
+def question_similarity(terms, other_terms):
+    if grading.NEGATIONS.intersection(terms) != grading.NEGATIONS.intersection(other_terms): return 0.0
+    return difflib.SequenceMatcher(None, terms, other_terms).ratio() if terms and other_terms else 0.0
+
+# Questions that lean on the conversation ("what does that mean?") are answered with the student's
+# summary and never cached. Every other question is answered from the lesson alone, so a cached
+# answer fits whichever student asks it.
+CONVERSATION_WORDS = frozenset('it its this that these those they them there again above before earlier previous last'.split())
+
+def qna_cacheable(question, conversation_summary):
+    if not conversation_summary: return True
+    key = qna_question_key(question)
+    return len(lesson_search.tokenize(key)) >= 2 and not CONVERSATION_WORDS.intersection(key.split())
+
+# An exact match on the normalized question first, then the closest earlier question by its terms
+# taken in order, so "is a capybara bigger than a hamster?" never finds the reverse question. Short questions ("what is it?") never match by similarity; they mean too little alone.
+def cached_qna_answer(lesson, question):
+    key = qna_question_key(question)
+    if not key: return None
+    fresh_after = datetime.datetime.utcnow() - datetime.timedelta(seconds=app.config['QNA_CACHE_TTL'])
+    candidates = lesson.qna_answers.filter(QnaAnswer.lesson_version == lesson_qna_version(lesson), QnaAnswer.created_at >= fresh_after)
+    entry = candidates.filter(QnaAnswer.question_key == key).first()
+    if not entry and len(lesson_search.tokenize(key)) >= 2 and app.config['QNA_CACHE_SIMILARITY'] <= 1:
+        terms, best_score, best_id = question_terms(key), 0.0, None
+        for entry_id, other_key in candidates.with_entities(QnaAnswer.id, QnaAnswer.question_key):
+            score = question_similarity(terms, question_terms(other_key))
+            if score > best_score: best_score, best_id = score, entry_id
+        if best_score >= app.config['QNA_CACHE_SIMILARITY']: entry = QnaAnswer.query.get(best_id)
+    if not entry: return None
+    entry.hit_count += 1
+    entry.last_used_at = datetime.datetime.utcnow()
+    return entry.answer
+
+# Commits on its own, before the chat turn does, so losing a race to an identical question
+# never costs the student their turn.
+def remember_qna_answer(lesson_id, lesson_version, question, answer):
+    key = qna_question_key(question)
+    if not key or not answer or answer in (EMPTY_TUTOR_REPLY, FAILED_TUTOR_REPLY): return
+    fresh_after = datetime.datetime.utcnow() - datetime.timedelta(seconds=app.config['QNA_CACHE_TTL'])
+    QnaAnswer.query.filter(QnaAnswer.lesson_id == lesson_id, db.or_(QnaAnswer.lesson_version != lesson_version, QnaAnswer.created_at < fresh_after)).delete(synchronize_session=False)
+    keep = db.session.query(QnaAnswer.id).filter_by(lesson_id=lesson_id).order_by(QnaAnswer.last_used_at.desc()).limit(app.config['QNA_CACHE_MAX_PER_LESSON'] - 1)
+    QnaAnswer.query.filter(QnaAnswer.lesson_id == lesson_id, QnaAnswer.id.notin_(keep.scalar_subquery())).delete(synchronize_session=False)
+    db.session.add(QnaAnswer(lesson_id=lesson_id, lesson_version=lesson_version, question_key=key, answer=answer))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # another student asked the same question at the same moment
+
+# Appends one clipped line per turn and drops the oldest lines once over the summary budget.
+def rolled_summary(summary, new_turns):
+    lines = summary.splitlines() if summary else []
+    for role, text in new_turns:
+        text = ' '.join(text.split())
+        if len(text) > SUMMARY_LINE_CHARS: text = text[:SUMMARY_LINE_CHARS - 3].rstrip() + '...'
+        lines.append(f"{'Student' if role == 'user' else 'Tutor'}: {text}")
+    while len(lines) > 1 and lesson_search.estimate_tokens('\n'.join(lines)) > app.config['QNA_SUMMARY_TOKENS']:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+# Works out what the tutor says next without calling the model. Returns (response_data, reply_text,
+# reply_prompt): reply_text is set when the reply is already known, reply_prompt when it still has
+# to be generated, and neither when the tutor stays silent this turn. is_answer says the input came
+# from the question the client showed; only those answers count towards question analytics.
+def plan_chat_turn(lesson, compiled, step_index, user_input, request_type, conversation_summary='', is_answer=False):
     if request_type == 'QNA':
-        qna_prompt = TUTOR_PROMPT_TEMPLATE['QNA'].format(lesson_script=lesson.raw_script, user_question=user_input)
-        ai_response = get_tutor_response(qna_prompt)
-
-        if ai_response.strip().startswith('[RETRIEVE_IMAGE:'):
-            try:
-                alt_text_to_find = ai_response.split('"')[1]
-                found_url = next((step.get('media_url') for step in lesson_data.get('steps', []) if step.get('type') == 'MEDIA' and step.get('alt_text') == alt_text_to_find), None)
-                
-                if found_url:
-                    model_response_text = f"Of course, here is the image of '{alt_text_to_find}':"
-                    response_data['media_url'] = found_url
-                else:
-                    model_response_text = "I found a mention of that image, but I couldn't retrieve the picture. Sorry about that."
-            except IndexError:
-                 model_response_text = "I had a little trouble retrieving that image. Please try asking in a different way."
-        else:
-            model_response_text = ai_response
-        
-        response_data['is_qna_response'] = True
-        response_data['next_step'] = step_index
-
-    else:  # LESSON_FLOW
-        # 1. Check if we need to grade a previous answer
-        if step_index > 0:
-            prev_step = lesson_data['steps'][step_index - 1]
-            if prev_step.get('type') in ['QUESTION_MCQ', 'QUESTION_SA']:
-                is_correct = False
-                if prev_step.get('type') == 'QUESTION_MCQ':
-                    if user_input and user_input.strip().upper() == prev_step.get('correct_answer', '').strip().upper():
-                        is_correct = True
-                elif prev_step.get('type') == 'QUESTION_SA':
-                    keywords = prev_step.get('keywords', [])
-                    grader_prompt = GRADER_PROMPT.format(", ".join(keywords), user_input)
-                    if "CORRECT" in get_tutor_response(grader_prompt).upper():
-                        is_correct = True
-                
-                if is_correct:
-                    response_data['feedback'] = "Correct! Great job."
-                else:
-                    relevant_content = "\n".join([s.get('text', '') for i, s in enumerate(lesson_data['steps']) if i < step_index - 1 and s.get('type') == 'CONTENT']) or "Let's review."
-                    model_response_text = get_tutor_response(TUTOR_PROMPT_TEMPLATE['RETRY'].format(relevant_content))
-                    response_data['next_step'] = step_index - 1 # Go back to the question step
-                    # This is a terminal state for this request, so we save and return early
-                    chat_history.append({'role': 'model', 'parts': [{'text': model_response_text}]})
-                    history_record.history_json = json.dumps(chat_history)
-                    history_record.current_step_index = response_data['next_step']
-                    db.session.commit()
-                    response_data['tutor_text'] = model_response_text
-                    return jsonify(response_data)
-
-        # 2. Process the current step
-        if step_index >= len(lesson_data['steps']):
-            response_data['is_lesson_end'] = True
-            model_response_text = "Congratulations! You have completed this chapter."
-            # ... (rest of lesson end logic is the same)
-        else:
-            current_step = lesson_data['steps'][step_index]
-            step_type = current_step.get('type')
-
-            if step_type == 'CONTENT':
-                prompt_template = TUTOR_PROMPT_TEMPLATE['FEEDBACK_AND_PROCEED'] if response_data.get('feedback') else TUTOR_PROMPT_TEMPLATE['CONTENT']
-                model_response_text = get_tutor_response(prompt_template.format(current_step.get('text', '')))
-            elif step_type == 'MEDIA':
-                if not current_step.get('media_url'): # Skip steps with missing media
-                    response_data['next_step'] = step_index + 1
-                    history_record.current_step_index = response_data['next_step']
-                    db.session.commit()
-                    return jsonify(response_data)
-                model_response_text = get_tutor_response(TUTOR_PROMPT_TEMPLATE['MEDIA'].format(current_step.get('alt_text', '')))
-                response_data['media_url'] = current_step.get('media_url')
-            elif step_type in ['QUESTION_MCQ', 'QUESTION_SA']:
-                response_data['question'] = current_step
-                model_response_text = get_tutor_response(TUTOR_PROMPT_TEMPLATE['QUESTION'].format(current_step.get('question', 'a question')))
-        
-        # 3. Determine the next step index
-        if 'next_step' not in response_data:
-            response_data['next_step'] = step_index + 1
-
-    # Centralized history saving and response preparation
+        response_data = {'is_qna_response': True, 'next_step': step_index}
+        if not qna_cacheable(user_input, conversation_summary):
+            return response_data, None, qna_prompt(lesson, conversation_summary, user_input)
+        cached_answer = cached_qna_answer(lesson, user_input)
+        if cached_answer: return response_data, resolve_qna_response(cached_answer, compiled, response_data), None
+        return response_data, None, qna_prompt(lesson, None, user_input)
+
+    renderers = lesson_engine.step_renderers(model_step_renderers(lesson.id), lesson.course.llm_paraphrase)
+    on_answer = (lambda step, is_correct: question_answered.send(app, lesson_id=lesson.id, step=step, is_correct=is_correct)) if is_answer else None
+    response_data, reply_text, reply_prompt = lesson_engine.advance(compiled, step_index, user_input, renderers, grade_short_answer, on_answer)
+    if response_data.get('media_url'): set_chat_media(response_data, response_data['media_url'])
+    return response_data, reply_text, reply_prompt
+
+CHAT_IMAGE_WIDTH = 640
+
+def set_chat_media(response_data, url):
+    image = responsive_image(url, CHAT_IMAGE_WIDTH)
+    response_data['media_url'] = image['src']
+    if image['srcset']: response_data['media_srcset'] = image['srcset']
+
+def resolve_qna_response(ai_response, compiled, response_data):
+    if not ai_response.strip().startswith('[RETRIEVE_IMAGE:'):
+        return ai_response
+    try:
+        alt_text_to_find = ai_response.split('"')[1]
+        found_url = compiled.media_urls.get(alt_text_to_find)
+        if found_url:
+            set_chat_media(response_data, found_url)
+            return f"Of course, here is the image of '{alt_text_to_find}':"
+        return "I found a mention of that image, but I couldn't retrieve the picture. Sorry about that."
+    except IndexError:
+        return "I had a little trouble retrieving that image. Please try asking in a different way."
+
+# --- Progress Events ---
+# Reaching the end of a chapter sends chapter_completed; receivers update their state with
+# conditional SQL in the same transaction as the chat history, so progress never needs recounting.
+progress_events = Namespace()
+student_enrolled = progress_events.signal('student-enrolled')
+question_answered = progress_events.signal('question-answered')
+chapter_completed = progress_events.signal('chapter-completed')
+progress_changed = progress_events.signal('progress-changed')  # an enrollment's progress actually moved
+review_submitted = progress_events.signal('review-submitted')
+
+# previous_chapter_number is the playable chapter before this one (0 for the first) and
+# last_chapter_number the course's last playable chapter.
+@chapter_completed.connect
+def update_enrollment_progress(sender, enrollment_id, course_id, chapter_number, previous_chapter_number, last_chapter_number, **extra):
+    # Progress moves one chapter at a time: the UPDATE only matches when the student's last completed
+    # chapter is the one right before this, so replays and chapters played out of order leave it alone.
+    advanced = Enrollment.query.filter_by(id=enrollment_id, last_completed_chapter_number=previous_chapter_number).update(
+        {'last_completed_chapter_number': chapter_number}, synchronize_session=False)
+    completed = Enrollment.query.filter(Enrollment.id == enrollment_id, Enrollment.completed_at.is_(None),
+                                        Enrollment.last_completed_chapter_number >= last_chapter_number).update(
+        {'completed_at': datetime.datetime.utcnow()}, synchronize_session=False)
+    if advanced or completed:
+        progress_changed.send(app, course_id=course_id, previous_chapter=previous_chapter_number if advanced else None, chapter_number=chapter_number, course_completed=bool(completed))
+
+# --- Creator Analytics ---
+# Rollups for the creator pages, kept current by receivers on progress_events (see analytics).
+creator_analytics = analytics.CreatorAnalytics(db, insert_ignoring_conflicts, course=Course, lesson=Lesson, enrollment=Enrollment,
+                                               course_stats=CourseStats, chapter_stats=ChapterProgressStats, question_stats=QuestionStats)
+creator_analytics.connect(progress_events)
+
+# Chapters that were never parsed cannot be played, so progress steps over them and the last
+# playable chapter completes the course.
+def complete_chapter(history_record, response_data):
+    course_id, chapter_number = db.session.query(Lesson.course_id, Lesson.chapter_number).filter(Lesson.id == history_record.lesson_id).one()
+    playable = playable_chapter_numbers(course_id)
+    chapter_completed.send(app, enrollment_id=history_record.enrollment_id, course_id=course_id, lesson_id=history_record.lesson_id, chapter_number=chapter_number,
+                           previous_chapter_number=max((n for n in playable if n < chapter_number), default=0), last_chapter_number=max(playable, default=chapter_number))
+    last_completed, completed_at = db.session.query(Enrollment.last_completed_chapter_number, Enrollment.completed_at).filter_by(id=history_record.enrollment_id).one()
+    if completed_at:
+        response_data['certificate_url'] = url_for('certificate_view', course_id=course_id)
+    else:
+        # The chapter the student is up to, which is not the next one when this was played out of order.
+        next_chapter = min((n for n in playable if n > last_completed), default=chapter_number + 1)
+        response_data['next_chapter_url'] = url_for('student_chapter_view', course_id=course_id, chapter_number=next_chapter)
+
+# Centralized history saving and response preparation
+def record_chat_turn(history_record, new_turns, response_data, model_response_text):
+    if response_data.get('is_lesson_end'): complete_chapter(history_record, response_data)
     if model_response_text:
-        chat_history.append({'role': 'model', 'parts': [{'text': model_response_text}]})
+        new_turns.append(('model', model_response_text))
         response_data['tutor_text'] = model_response_text
-    
+
     if response_data.get('feedback'): # Also add feedback to history
-        chat_history.append({'role': 'model', 'parts': [{'text': response_data['feedback']}]})
+        new_turns.append(('model', response_data['feedback']))
 
-    history_record.history_json = json.dumps(chat_history)
-    history_record.current_step_index = response_data['next_step']
+def save_chat_turns(history_record, new_turns, next_step):
+    for role, text in new_turns:
+        history_record.append_turn(role, text)
+    history_record.summary = rolled_summary(history_record.summary, new_turns)
+    history_record.current_step_index = next_step
     db.session.commit()
 
-    return jsonify(response_data)
+def finish_chat_turn(history_record, new_turns, response_data, model_response_text):
+    record_chat_turn(history_record, new_turns, response_data, model_response_text)
+    save_chat_turns(history_record, new_turns, response_data['next_step'])
+    return response_data
+
+def start_chat_turn():
+    data = request.json
+    lesson, compiled, history_record = load_chat_state(data)
+    user_input = data.get('user_input')
+    request_type = data.get('request_type', 'LESSON_FLOW')
+
+    new_turns = [('user', user_input)] if user_input else []
+
+    response_data, reply_text, reply_prompt = plan_chat_turn(lesson, compiled, history_record.current_step_index, user_input, request_type, history_record.summary,
+                                                             bool(data.get('is_answer')))
+    if request_type != 'QNA': prefetch_next_chapter(lesson, compiled, response_data['next_step'])
+    # A cacheable question the model still has to answer: what remember_qna_answer needs to cache the answer.
+    cacheable = request_type == 'QNA' and reply_prompt and qna_cacheable(user_input, history_record.summary)
+    qna = (lesson.id, lesson_qna_version(lesson), user_input) if cacheable else None
+    return compiled, history_record, new_turns, qna, response_data, reply_text, reply_prompt
+
+@app.route('/chat', methods=['POST'])
+@login_required
+def chat():
+    compiled, history_record, new_turns, qna, response_data, reply_text, reply_prompt = start_chat_turn()
+    if reply_prompt:
+        reply_text = get_tutor_response(reply_prompt)
+        if qna: remember_qna_answer(*qna, reply_text)
+        if response_data.get('is_qna_response'): reply_text = resolve_qna_response(reply_text, compiled, response_data)
+    return jsonify(finish_chat_turn(history_record, new_turns, response_data, reply_text))
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+# Same turn as /chat, sent as Server-Sent Events: a `meta` event with everything known up front,
+# `token` events while the model writes, and a `done` event with the final response once history is saved.
+@app.route('/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    compiled, history_record, new_turns, qna, response_data, reply_text, reply_prompt = start_chat_turn()
+    db.session.commit()  # keep cache bookkeeping from planning the turn; the session ends before the body streams
+
+    def generate():
+        # The app context (and its session) is torn down before the body streams; reattach the record.
+        db.session.add(history_record)
+        yield sse_event('meta', response_data)
+        final_text = reply_text
+        if reply_prompt:
+            parts, held_back, outcome = [], '', {}
+            for text in stream_tutor_response(reply_prompt, outcome):
+                parts.append(text)
+                if response_data.get('is_qna_response') and held_back is not None:
+                    # Hold back anything that may turn out to be a [RETRIEVE_IMAGE: ...] tag.
+                    held_back += text
+                    head = held_back.lstrip()
+                    if head.startswith('[RETRIEVE_IMAGE:') or '[RETRIEVE_IMAGE:'.startswith(head): continue
+                    text, held_back = held_back, None
+                yield sse_event('token', {'text': text})
+            final_text = ''.join(parts)
+            if qna and outcome.get('complete'): remember_qna_answer(*qna, final_text)
+            if response_data.get('is_qna_response'): final_text = resolve_qna_response(final_text, compiled, response_data)
+        elif reply_text:
+            yield sse_event('token', {'text': reply_text})
+        yield sse_event('done', finish_chat_turn(history_record, new_turns, response_data, final_text))
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- Batched Lesson Flow ---
+BATCH_MAX_STEPS = 25
+
+# LESSON_FLOW turns from step_index up to and including the next one that waits on the student:
+# a question, a retry hint or the end of the chapter. Returns (planned turns, next step index).
+def plan_chat_batch(lesson, compiled, step_index, user_input, is_answer=False):
+    planned = []
+    for _ in range(BATCH_MAX_STEPS):
+        response_data, reply_text, reply_prompt = plan_chat_turn(lesson, compiled, step_index, user_input, 'LESSON_FLOW', is_answer=is_answer)
+        user_input, is_answer = None, False  # only the first turn answers anything
+        next_step = response_data['next_step']
+        if len(response_data) > 1 or reply_text or reply_prompt:  # a bare next_step is a skipped step
+            planned.append((response_data, reply_text, reply_prompt))
+            if response_data.get('question') or response_data.get('is_lesson_end') or next_step <= step_index: break
+        step_index = next_step
+    return planned, next_step
+
+# Advances through every step that needs no input in one request: the model calls for them run
+# concurrently, and the history is saved in one commit. Returns the turns in order.
+@app.route('/chat/advance', methods=['POST'])
+@login_required
+def chat_advance():
+    data = request.json
+    lesson, compiled, history_record = load_chat_state(data)
+    user_input = data.get('user_input')
+    new_turns = [('user', user_input)] if user_input else []
+    step_index = history_record.current_step_index
+    planned, next_step = plan_chat_batch(lesson, compiled, step_index, user_input, bool(data.get('is_answer')))
+    prefetch_next_chapter(lesson, compiled, next_step)
+    replies = get_tutor_responses([reply_prompt for _, _, reply_prompt in planned])
+    turns = []
+    for (response_data, reply_text, reply_prompt), reply in zip(planned, replies):
+        if reply_prompt and reply in (EMPTY_TUTOR_REPLY, FAILED_TUTOR_REPLY):
+            # The batch stops short of a turn the model did not write, so the next request retries it.
+            failed_turn = {'next_step': step_index, 'tutor_text': FAILED_TUTOR_REPLY}
+            if not turns:
+                # Nothing to keep, not even the answer: the student is asked the question again.
+                db.session.rollback()
+                if 0 < step_index <= len(compiled.steps) and compiled.steps[step_index - 1].get('type') in lesson_engine.QUESTION_TYPES:
+                    failed_turn['question'] = compiled.steps[step_index - 1]
+                return jsonify({'turns': [failed_turn]})
+            save_chat_turns(history_record, new_turns, step_index)
+            return jsonify({'turns': turns + [failed_turn]})
+        record_chat_turn(history_record, new_turns, response_data, reply if reply_prompt else reply_text)
+        turns.append(response_data)
+        step_index = response_data['next_step']
+    save_chat_turns(history_record, new_turns, next_step)
+    return jsonify({'turns': turns})
+
+# --- Chapter Prefetch ---
+# A chapter's opening (step 0 up to its first question) is the same for every student, so it is
+# planned once, kept for CHAPTER_PREFETCH_TTL, and shipped with the player page. It stops short of
+# the end of the chapter: completing it is progress, which loading a page must never record. Students nearing
+# the end of a chapter warm the next chapter's opening in the background.
+chapter_openings = OrderedDict()  # lesson id -> (version key, expires_at, (turns, next_step))
+chapter_openings_lock = threading.Lock()
+CHAPTER_OPENINGS_MAX = 256
+prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+prefetching = set()  # lessons whose next chapter is being warmed right now
+
+# Returns (turns, next_step), with turns as (response_data, reply_text) pairs. Without `generate`
+# it returns None rather than wait on the model for a turn that was not pre-rendered.
+def chapter_opening(lesson, generate=False):
+    version_key = (lesson.version, lesson.course.llm_paraphrase)
+    with chapter_openings_lock:
+        entry = chapter_openings.get(lesson.id)
+        if entry and entry[0] == version_key and entry[1] > time.monotonic():
+            chapter_openings.move_to_end(lesson.id)
+            return entry[2]
+    compiled = compiled_lesson(lesson)
+    planned, next_step = plan_chat_batch(lesson, compiled, 0, None)
+    if planned and planned[-1][0].get('is_lesson_end'):
+        planned.pop()
+        next_step = len(compiled.steps)  # the student's first Continue plans the end turn
+    if not planned: return None
+    prompts = [reply_prompt for _, _, reply_prompt in planned]
+    if any(prompts) and not generate: return None
+    replies = get_tutor_responses(prompts)
+    if FAILED_TUTOR_REPLY in replies: return None  # not worth handing to every student
+    opening = ([(response_data, reply if reply_prompt else reply_text) for (response_data, reply_text, reply_prompt), reply in zip(planned, replies)], next_step)
+    with chapter_openings_lock:
+        chapter_openings[lesson.id] = (version_key, time.monotonic() + app.config['CHAPTER_PREFETCH_TTL'], opening)
+        chapter_openings.move_to_end(lesson.id)
+        while len(chapter_openings) > CHAPTER_OPENINGS_MAX:
+            chapter_openings.popitem(last=False)
+    return opening
+
+def run_chapter_prefetch(lesson_id, course_id, chapter_number):
+    try:
+        with app.app_context():
+            next_lesson = Lesson.query.filter(Lesson.course_id == course_id, Lesson.chapter_number > chapter_number).order_by(Lesson.chapter_number).first()
+            if next_lesson and next_lesson.is_playable:
+                chapter_opening(next_lesson, generate=True)
+    except Exception as e:
+        print(f"Error prefetching the next chapter: {e}")
+    finally:
+        with chapter_openings_lock:
+            prefetching.discard(lesson_id)
+
+def prefetch_next_chapter(lesson, compiled, next_step):
+    if next_step < len(compiled.steps) - app.config['CHAPTER_PREFETCH_STEPS']: return
+    with chapter_openings_lock:
+        if lesson.id in prefetching: return
+        prefetching.add(lesson.id)
+    prefetch_pool.submit(run_chapter_prefetch, lesson.id, lesson.course_id, lesson.chapter_number)
+
+# Saves a chapter's opening as the start of the student's history and returns the turns for the page.
+def start_chapter_from_opening(lesson, enrollment, history_record, opening):
+    turns, next_step = opening
+    if not history_record:
+        history_record = ChatHistory(enrollment_id=enrollment.id, lesson_id=lesson.id)
+        db.session.add(history_record)
+    new_turns, shipped = [], []
+    for response_data, reply_text in turns:
+        response_data = dict(response_data)  # the cached copy is shared by every student
+        record_chat_turn(history_record, new_turns, response_data, reply_text)
+        shipped.append(response_data)
+    save_chat_turns(history_record, new_turns, next_step)
+    return shipped
+
 # --- NEW CHAT CONTROL ROUTES ---
 @app.route('/chat/reset', methods=['POST'])
 @login_required
 def reset_conversation():
-    lesson_id = request.json.get('lesson_id')
-    lesson = Lesson.query.get_or_404(lesson_id)
-    enrollment = Enrollment.query.filter_by(user_id=current_user.id, course_id=lesson.course_id).first()
+    context = load_lesson_context(lesson_id=request.json.get('lesson_id'))
+    if not context: abort(404)
+    lesson, course, enrollment, history_record = context
     if not enrollment: abort(403)
-    history_record = ChatHistory.query.filter_by(enrollment_id=enrollment.id, lesson_id=lesson.id).first()
     if history_record:
-        history_record.history_json = '[]'
+        history_record.turns_query().delete(synchronize_session=False)
         history_record.current_step_index = 0
+        history_record.summary = ''
         db.session.commit()
     return jsonify({'success': True, 'message': 'Conversation has been reset.'})
 
 @app.route('/chat/delete_last_turn', methods=['POST'])
 @login_required
 def delete_last_turn():
-    lesson_id = request.json.get('lesson_id')
-    lesson = Lesson.query.get_or_404(lesson_id)
-    enrollment = Enrollment.query.filter_by(user_id=current_user.id, course_id=lesson.course_id).first()
+    context = load_lesson_context(lesson_id=request.json.get('lesson_id'))
+    if not context: abort(404)
+    lesson, course, enrollment, history_record = context
     if not enrollment: abort(403)
-    history_record = ChatHistory.query.filter_by(enrollment_id=enrollment.id, lesson_id=lesson.id).first()
     if not history_record: return jsonify({'success': False, 'message': 'No history to delete.'}), 404
-    history = json.loads(history_record.history_json)
-    if not history: return jsonify({'success': False, 'message': 'History is already empty.'}), 400
-    last_user_index = -1
-    for i in range(len(history) - 1, -1, -1):
-        if history[i].get('role') == 'user':
-            last_user_index = i
-            break
-    if last_user_index != -1: history = history[:last_user_index]
-    else: history = []
-    history_record.history_json = json.dumps(history)
+    # Everything from the last student message onwards goes, or everything if the student never spoke.
+    last_user_seq = db.session.query(db.func.max(ChatTurn.seq)).filter(
+        ChatTurn.enrollment_id == enrollment.id, ChatTurn.lesson_id == lesson.id, ChatTurn.role == 'user').scalar()
+    deleted = history_record.turns_query().filter(ChatTurn.seq >= (last_user_seq or 0)).delete(synchronize_session=False)
+    if not deleted: return jsonify({'success': False, 'message': 'History is already empty.'}), 400
+    recent_turns = history_record.turns_query().order_by(ChatTurn.seq.desc()).limit(SUMMARY_REBUILD_TURNS).all()
+    history_record.summary = rolled_summary('', [(turn.role, turn.text) for turn in reversed(recent_turns)])
     db.session.commit()
-    return jsonify({'success': True, 'new_history': history, 'message': 'Last turn deleted.'})
+    return jsonify({'success': True, 'new_history': history_record.messages(), 'message': 'Last turn deleted.'})
 
 # --- Other Routes ---
 @app.route('/course/<string:course_id>/enroll', methods=['POST'])
@@ -625,6 +1860,7 @@ def enroll_in_course(course_id):
         return redirect(url_for('course_player', course_id=course.id))
     new_enrollment = Enrollment(user=current_user, course=course)
     db.session.add(new_enrollment)
+    student_enrolled.send(app, course_id=course.id)
     db.session.commit()
     flash(f"You have successfully enrolled in '{course.title}'!", 'success')
     return redirect(url_for('course_player', course_id=course.id))
@@ -653,6 +1889,7 @@ def submit_review(course_id):
         return redirect(url_for('certificate_view', course_id=course.id))
     new_review = Review(rating=int(rating), comment=comment, course_id=course.id, user_id=current_user.id)
     db.session.add(new_review)
+    review_submitted.send(app, course_id=course.id, rating=new_review.rating)
     db.session.commit()
     flash("Thank you for your feedback!", "success")
     return redirect(url_for('reviews_page', course_id=course.id))
@@ -663,8 +1900,8 @@ def certificate_view(course_id):
     enrollment = Enrollment.query.filter_by(user_id=current_user.id, course_id=course_id).first_or_404()
     if not enrollment.completed_at:
         flash("You have not completed this course yet.", "warning")
-        return redirect(url_for('course_player', course_id=course.id))
-    existing_review = Review.query.filter_by(user_id=current_user.id, course_id=course.id).first()
+        return redirect(url_for('course_player', course_id=course_id))
+    existing_review = Review.query.filter_by(user_id=current_user.id, course_id=course_id).first()
     return render_template('certificate.html', enrollment=enrollment, existing_review=existing_review)
 
 @app.route('/course/<string:course_id>/update_details', methods=['POST'])
@@ -673,13 +1910,20 @@ def update_course_details(course_id):
     course = Course.query.get_or_404(course_id)
     if course.creator.id != current_user.id: abort(403)
     course.description = request.form.get('description')
+    llm_paraphrase = request.form.get('llm_paraphrase') == 'on'
+    if llm_paraphrase and not course.llm_paraphrase:
+        # Pre-render the question, image and feedback turns the templates used to cover. Chapters still
+        # being parsed pre-render theirs when their parse finishes; failed ones have nothing to render.
+        for lesson in course.lessons:
+            if lesson.status != 'parsed': continue
+            db.session.add(IngestJob(lesson=lesson, payload_json=json.dumps({'pregenerate_only': True})))
+    course.llm_paraphrase = llm_paraphrase
     if 'thumbnail' in request.files:
         file = request.files['thumbnail']
         if file.filename != '':
-            filename = str(uuid.uuid4()) + os.path.splitext(file.filename)[1]
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            course.thumbnail_url = url_for('static', filename=f'uploads/{filename}')
+            course.thumbnail_url = store_media_file(file)
+            sync_media_refs('course', course.id, [course.thumbnail_url])
+    refresh_course_search(course.id)
     db.session.commit()
     flash('Course details updated successfully!', 'success')
     return redirect(url_for('manage_course', course_id=course.id))
@@ -717,5 +1961,176 @@ def shared_course_view(link_id):
     course = Course.query.filter_by(shareable_link_id=link_id).first_or_404()
     return render_template('course_detail.html', course=course)
 
+# --- CLI Commands ---
+def run_ingest_worker_process():
+    with app.app_context():
+        db.engine.dispose(close=False)  # never share pooled connections across a fork
+    run_ingest_worker()
+
+@app.cli.command('ingest-worker')
+@click.option('--processes', default=1, help='Worker processes to run; each claims its own jobs.')
+def ingest_worker(processes):
+    """Process queued chapter ingestion jobs until interrupted."""
+    click.echo(f"Starting {processes} ingest worker process(es).")
+    workers = [multiprocessing.Process(target=run_ingest_worker_process, daemon=True) for _ in range(processes)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+
+@app.cli.command('llm-loadtest')
+@click.option('--requests', 'total', default=200, help='Number of prompts to send.')
+@click.option('--concurrency', default=50, help='Simultaneous callers, like busy WSGI workers.')
+def llm_loadtest(total, concurrency):
+    """Push prompts through the LLM gateway and report latency. Run with LLM_BACKEND=fake to test offline."""
+    def timed_call(i):
+        started = time.perf_counter()
+        try:
+            llm.generate(f"Load test prompt {i}")
+            return time.perf_counter() - started, None
+        except Exception as e:
+            return time.perf_counter() - started, type(e).__name__
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed_call, range(total)))
+    latencies = sorted(latency for latency, error in results if error is None)
+    errors = Counter(error for _, error in results if error)
+    click.echo(f"{len(latencies)}/{total} ok in {time.perf_counter() - started:.2f}s, errors: {dict(errors) or 'none'}")
+    if latencies:
+        click.echo(f"p50 {latencies[len(latencies) // 2]:.3f}s  p95 {latencies[int(len(latencies) * 0.95) - 1]:.3f}s  max {latencies[-1]:.3f}s")
+
+@app.cli.command('import-course')
+@click.argument('course_id')
+@click.argument('archive_path', type=click.Path(exists=True, dir_okay=False))
+def import_course(course_id, archive_path):
+    """Import every chapter in a .zip archive into an existing course, in one transaction."""
+    course = Course.query.get(course_id)
+    if not course: raise click.ClickException(f"No course with id {course_id}.")
+    with app.test_request_context():  # media urls are built with url_for
+        lessons, errors = import_course_archive(course, archive_path)
+    if errors: raise click.ClickException('\n'.join(errors))
+    click.echo(f"Imported {len(lessons)} chapter(s) into '{course.title}'.")
+
+@app.cli.command('media-gc')
+@click.option('--grace-hours', default=24.0, help='Keep blobs whose last reference went away more recently than this.')
+@click.option('--dry-run', is_flag=True, help='Only report what would be deleted.')
+def media_gc(grace_hours, dry_run):
+    """Delete stored media that no lesson or course references any more."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=grace_hours)
+    orphans = db.session.query(MediaBlob.key, MediaBlob.extension, MediaBlob.size_bytes, MediaBlob.variant_widths_json).filter(
+        MediaBlob.ref_count <= 0, db.func.coalesce(MediaBlob.released_at, MediaBlob.created_at) < cutoff).all()
+    deleted, freed = 0, 0
+    for key, extension, size_bytes, variant_widths_json in orphans:
+        if not dry_run:
+            # Re-checked in the DELETE itself, so a reference taken since the query keeps the blob.
+            if not MediaBlob.query.filter(MediaBlob.key == key, MediaBlob.ref_count <= 0).delete(synchronize_session=False): continue
+            db.session.commit()
+            paths = [media_path(key, extension)] + [os.path.join(app.config['UPLOAD_FOLDER'], media_variants.variant_name(key, width)) for width in json.loads(variant_widths_json)]
+            for path in paths:
+                if os.path.exists(path): os.remove(path)
+        deleted += 1
+        freed += size_bytes
+    click.echo(f"{'Would delete' if dry_run else 'Deleted'} {deleted} unreferenced file(s), {freed / 1024 / 1024:.1f} MB.")
+
+@app.cli.command('media-adopt')
+def media_adopt():
+    """Move uploads saved before the media store into it, merging byte-identical copies."""
+    adopted = {}  # legacy url -> store url
+    def adopt(url):
+        if not url or media_key(url) or '/uploads/' not in url: return url
+        if url not in adopted:
+            path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(url))
+            if not os.path.isfile(path): adopted[url] = url  # already broken; leave it be
+            else:
+                with open(path, 'rb') as legacy_file:
+                    adopted[url] = store_media_file(FileStorage(stream=legacy_file, filename=path))
+        return adopted[url]
+    with app.test_request_context():  # media urls are built with url_for
+        for (lesson_id,) in db.session.query(Lesson.id).all():
+            lesson = Lesson.query.get(lesson_id)
+            steps = json.loads(lesson.parsed_json).get('steps', [])
+            changed = False
+            for step in steps:
+                if step.get('type') != 'MEDIA' or not step.get('media_url'): continue
+                new_url = adopt(step['media_url'])
+                if new_url != step['media_url']: step['media_url'], changed = new_url, True
+            if changed:
+                lesson.parsed_json = json.dumps({'steps': steps})
+                lesson.version = Lesson.version + 1
+            for job in lesson.ingest_jobs.filter(IngestJob.status.in_(('pending', 'running'))):
+                payload = json.loads(job.payload_json)
+                if payload.get('media_urls'):
+                    payload['media_urls'] = [adopt(url) for url in payload['media_urls']]
+                    job.payload_json = json.dumps(payload)
+            db.session.flush()
+            sync_media_refs('lesson', lesson.id, lesson_media_urls(lesson))
+            db.session.commit()
+        for course in Course.query.filter(Course.thumbnail_url.isnot(None)).all():
+            course.thumbnail_url = adopt(course.thumbnail_url)
+            sync_media_refs('course', course.id, [course.thumbnail_url])
+            db.session.commit()
+    moved = {url: new_url for url, new_url in adopted.items() if new_url != url}
+    for url in moved:
+        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(url)))
+    click.echo(f"Moved {len(moved)} legacy file(s) into {len(set(moved.values()))} stored blob(s).")
+
+@app.cli.command('analytics-compact')
+def analytics_compact():
+    """Rebuild the creator analytics rollups from their sources; run it periodically, e.g. nightly from cron."""
+    live_questions = lambda lesson: [step.get('question') for step in compiled_lesson(lesson).steps if step.get('type') in lesson_engine.QUESTION_TYPES]
+    courses, pruned = creator_analytics.compact(live_questions)
+    click.echo(f"Rebuilt enrollment rollups for {courses} course(s); pruned {pruned} stale question row(s).")
+
+# Read from the cache tables rather than per-process counters, so it covers every web and worker
+# process. Each entry is one model call made; each hit is one saved.
+@app.cli.command('cache-stats')
+def cache_stats():
+    """Report how much the model-call caches hold and how often they have been hit."""
+    entries, size_bytes, hits = db.session.query(db.func.count(ParseCache.key), db.func.coalesce(db.func.sum(ParseCache.size_bytes), 0),
+                                                 db.func.coalesce(db.func.sum(ParseCache.hit_count), 0)).one()
+    click.echo(f"parse cache: {entries} entries ({size_bytes / 1024 / 1024:.1f} of {app.config['PARSE_CACHE_MAX_BYTES'] / 1024 / 1024:.1f} MB), {hits} hits")
+    entries, lessons, hits = db.session.query(db.func.count(QnaAnswer.id), db.func.count(db.distinct(QnaAnswer.lesson_id)),
+                                              db.func.coalesce(db.func.sum(QnaAnswer.hit_count), 0)).one()
+    click.echo(f"QNA answers: {entries} entries across {lessons} lessons, {hits} hits")
+    entries, hits = db.session.query(db.func.count(GradeVerdict.key), db.func.coalesce(db.func.sum(GradeVerdict.hit_count), 0)).one()
+    click.echo(f"short-answer verdicts: {entries} entries, {hits} hits (answers graded locally are not counted)")
+
+# Hot queries as the routes issue them, with placeholder values; each must be served by an index.
+def hot_queries():
+    return {
+        'enrollment lookup (is_enrolled, chat)': Enrollment.query.filter_by(user_id=1, course_id='c'),
+        'course enrollees': Enrollment.query.filter_by(course_id='c'),
+        'chapter by number (player)': Lesson.query.filter_by(course_id='c', chapter_number=1),
+        'last chapter (save_chapter)': Lesson.query.filter_by(course_id='c').order_by(Lesson.chapter_number.desc()).limit(1),
+        'course chapters': Lesson.query.filter_by(course_id='c').order_by(Lesson.chapter_number),
+        'chat history': ChatHistory.query.filter_by(enrollment_id=1, lesson_id='l'),
+        'chat turns': ChatTurn.query.filter_by(enrollment_id=1, lesson_id='l').order_by(ChatTurn.seq),
+        'course reviews (reviews_page)': Review.query.filter_by(course_id='c').order_by(Review.created_at.desc()),
+        'review by student': Review.query.filter_by(user_id=1, course_id='c'),
+        'explore page': Course.query.filter(Course.is_published == True).order_by(Course.title, Course.id).limit(24),
+        'creator courses': Course.query.filter_by(user_id=1).order_by(Course.title),
+        'pre-rendered tutor turn': TutorTurn.query.filter_by(lesson_id='l', prompt_hash='h'),
+        'next ingest job': IngestJob.query.filter_by(status='pending').order_by(IngestJob.created_at).limit(1),
+        'next media variants': MediaBlob.query.filter_by(variant_status='pending').order_by(MediaBlob.created_at).limit(1),
+        'chapter ingest jobs': IngestJob.query.filter_by(lesson_id='l').order_by(IngestJob.created_at.desc()),
+        'cached QNA answer': QnaAnswer.query.filter_by(lesson_id='l', lesson_version='v', question_key='q'),
+        'course stats (creator pages)': CourseStats.query.filter(CourseStats.course_id.in_(['c'])),
+        'completion funnel': ChapterProgressStats.query.filter_by(course_id='c'),
+        'question accuracy': QuestionStats.query.join(Lesson, Lesson.id == QuestionStats.lesson_id).filter(Lesson.course_id == 'c'),
+    }
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if any hot query is planned as a full table scan (SQLite EXPLAIN QUERY PLAN)."""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException("Query plans are only checked on SQLite.")
+    scans = []
+    for name, query in hot_queries().items():
+        sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        details = [row[-1] for row in db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+        # "SCAN t USING INDEX ..." walks an index in order; a bare "SCAN t" reads the whole table.
+        table_scans = [detail for detail in details if detail.startswith('SCAN') and ' USING ' not in detail]
+        click.echo(f"{'SCAN' if table_scans else 'ok  '}  {name}: {'; '.join(details)}")
+        scans.extend(table_scans)
+    if scans: raise click.ClickException(f"{len(scans)} hot query plan(s) fall back to a table scan.")
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,61 @@
+import difflib
+import html
+import re
+
+# Local grading of short answers against a QUESTION_SA step's keywords. grade() returns a
+# verdict only when it is confident either way, and None when the answer should go to the model.
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+NEGATIONS = frozenset('no not never none nothing neither nor without'.split())
+SUFFIXES = ('ational', 'ations', 'ation', 'ingly', 'ating', 'ated', 'ates', 'ings', 'ness', 'ment', 'ing', 'ate', 'ies', 'ied', 'ed', 'es', 'ly', 'y', 's')
+FUZZY_MIN_LENGTH = 4
+FUZZY_MIN_RATIO = 0.8
+
+def normalize(text):
+    text = html.unescape(text or '').lower().replace("n't", ' not')
+    return ' '.join(WORD_PATTERN.findall(text))
+
+# A light suffix stripper: enough to make "evaporates", "evaporated" and "evaporation" agree.
+def stem(word):
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+# Near misses ("evaporaton") score their similarity, but never settle an answer on their own: a
+# near miss can be a different word ("planet" for "plant"), so only exact stems count toward
+# accepting an answer locally.
+def word_score(keyword_stem, answer_stem, fuzzy=True):
+    if keyword_stem == answer_stem: return 1.0
+    if not fuzzy or min(len(keyword_stem), len(answer_stem)) < FUZZY_MIN_LENGTH: return 0.0
+    ratio = difflib.SequenceMatcher(None, keyword_stem, answer_stem).ratio()
+    return ratio if ratio >= FUZZY_MIN_RATIO else 0.0
+
+# How well the answer covers one keyword (every word of a multi-word keyword must appear). A match
+# right after a negation ("not water") only counts half, which leaves the verdict to the model.
+def keyword_score(keyword, answer_words, fuzzy=True):
+    answer_stems = [stem(word) for word in answer_words]
+    score = 1.0
+    for keyword_word in normalize(keyword).split():
+        keyword_stem = stem(keyword_word)
+        best, best_at = 0.0, None
+        for position, answer_stem in enumerate(answer_stems):
+            candidate = word_score(keyword_stem, answer_stem, fuzzy)
+            if candidate > best: best, best_at = candidate, position
+        if best_at is not None and NEGATIONS.intersection(answer_words[max(best_at - 2, 0):best_at]):
+            best /= 2
+        score = min(score, best)
+    return score
+
+# Returns (is_correct, coverage): is_correct is True when exact matches alone cover accept_at,
+# False when coverage (near misses included) is below reject_below, and None in between.
+def grade(answer, keywords, accept_at=0.9, reject_below=0.34):
+    answer_words = normalize(answer).split()
+    keywords = [keyword for keyword in keywords if normalize(keyword)]
+    if not keywords: return None, 0.0
+    if not answer_words: return False, 0.0
+    coverage = sum(keyword_score(keyword, answer_words) for keyword in keywords) / len(keywords)
+    exact_coverage = sum(keyword_score(keyword, answer_words, fuzzy=False) for keyword in keywords) / len(keywords)
+    if exact_coverage >= accept_at: return True, coverage
+    if coverage < reject_below: return False, coverage
+    return None, coverage
@@ -0,0 +1,98 @@
+# The LESSON_FLOW state machine. advance() grades the answer to the previous step when it was a
+# question, then plans the turn for the current step. What the tutor says comes from renderers,
+# looked up by the kind of turn:
+#   CONTENT   a CONTENT step              FEEDBACK  a CONTENT step right after a correct answer
+#   MEDIA     a MEDIA step                QUESTION  a QUESTION_MCQ or QUESTION_SA step
+#   RETRY     a hint after a wrong answer, called with the question's step index
+# A renderer takes (compiled, step_index) and returns (text, None) when the words are ready, or
+# (None, prompt) when the model has to write them.
+
+CORRECT_FEEDBACK = "Correct! Great job."
+LESSON_END_TEXT = "Congratulations! You have completed this chapter."
+QUESTION_TYPES = ('QUESTION_MCQ', 'QUESTION_SA')
+STEP_KINDS = {'CONTENT': 'CONTENT', 'MEDIA': 'MEDIA', 'QUESTION_MCQ': 'QUESTION', 'QUESTION_SA': 'QUESTION'}
+
+# A parsed lesson prepared once per process and version: the steps, the CONTENT text before each
+# step (for RETRY hints) and the alt text -> media url index (for [RETRIEVE_IMAGE] answers).
+class CompiledLesson:
+    def __init__(self, lesson_id, version, steps):
+        self.lesson_id = lesson_id
+        self.version = version
+        self.steps = steps
+        texts, length, self.content_ends = [], -1, []
+        self.media_urls = {}
+        for step in steps:
+            # content_ends[i] is where the CONTENT text of steps 0..i-1 ends in content_text.
+            self.content_ends.append(max(length, 0))
+            if step.get('type') == 'CONTENT':
+                texts.append(step.get('text', ''))
+                length += len(texts[-1]) + 1
+            elif step.get('type') == 'MEDIA':
+                self.media_urls.setdefault(step.get('alt_text'), step.get('media_url'))
+        self.content_text = '\n'.join(texts)
+
+    def content_before(self, step_index):
+        return self.content_text[:self.content_ends[step_index]] if step_index < len(self.steps) else self.content_text
+
+# --- Templated Renderers ---
+def render_media_template(compiled, step_index):
+    alt_text = (compiled.steps[step_index].get('alt_text') or '').strip()
+    return (f"Take a look at this image: {alt_text}" if alt_text else "Take a look at this image."), None
+
+def render_question_template(compiled, step_index):
+    question = (compiled.steps[step_index].get('question') or '').strip()
+    return (f"Time for a quick question: {question}" if question else "Time for a quick question!"), None
+
+TEMPLATE_RENDERERS = {
+    'MEDIA': render_media_template,
+    'QUESTION': render_question_template,
+}
+
+# Templated wording for images, questions and the feedback after a correct answer, unless the
+# course opted into having the model paraphrase every turn. Lesson text and RETRY hints always
+# come from the model.
+def step_renderers(model_renderers, paraphrase=False):
+    if paraphrase: return model_renderers
+    return {**model_renderers, 'FEEDBACK': model_renderers['CONTENT'], **TEMPLATE_RENDERERS}
+
+def is_correct_answer(step, user_input, grade_short_answer):
+    if step.get('type') == 'QUESTION_MCQ':
+        return bool(user_input) and user_input.strip().upper() == step.get('correct_answer', '').strip().upper()
+    return grade_short_answer(step, user_input)
+
+# Returns (response_data, reply_text, reply_prompt) for a LESSON_FLOW turn at step_index.
+# grade_short_answer(step, user_input) decides QUESTION_SA answers; on_answer(step, is_correct),
+# when given, hears about every graded answer.
+def advance(compiled, step_index, user_input, renderers, grade_short_answer, on_answer=None):
+    response_data = {}
+
+    # 1. Grade the answer to the previous step, if it was a question
+    if 0 < step_index <= len(compiled.steps):
+        prev_step = compiled.steps[step_index - 1]
+        if prev_step.get('type') in QUESTION_TYPES:
+            is_correct = is_correct_answer(prev_step, user_input, grade_short_answer)
+            if on_answer: on_answer(prev_step, is_correct)
+            if not is_correct:
+                reply_text, reply_prompt = renderers['RETRY'](compiled, step_index - 1)
+                return {'next_step': step_index - 1}, reply_text, reply_prompt  # back to the question
+            response_data['feedback'] = CORRECT_FEEDBACK
+
+    # 2. Plan the current step
+    reply_text, reply_prompt = None, None
+    if step_index >= len(compiled.steps):
+        response_data['is_lesson_end'] = True
+        reply_text = LESSON_END_TEXT
+    else:
+        step = compiled.steps[step_index]
+        kind = STEP_KINDS.get(step.get('type'))
+        if kind == 'MEDIA':
+            if not step.get('media_url'): return {'next_step': step_index + 1}, None, None  # skip steps with missing media
+            response_data['media_url'] = step['media_url']
+        elif kind == 'QUESTION':
+            response_data['question'] = step
+        elif kind == 'CONTENT' and response_data.get('feedback'):
+            kind = 'FEEDBACK'
+        if kind: reply_text, reply_prompt = renderers[kind](compiled, step_index)
+
+    response_data['next_step'] = step_index + 1
+    return response_data, reply_text, reply_prompt
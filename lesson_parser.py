@@ -0,0 +1,91 @@
+import html
+import re
+
+# Local parser for the tag syntax described in PARSER_PROMPT. It produces the same
+# {"steps": [...]} schema as the model, and raises ScriptParseError for anything it is not
+# sure about so the caller can fall back to the model.
+
+TAG_START_PATTERN = re.compile(r'\[(IMAGE|QUESTION_SA|QUESTION):')
+UNKNOWN_TAG_PATTERN = re.compile(r'\[[A-Z_]+:')
+IMAGE_PATTERN = re.compile(r'^\[IMAGE:\s*alt\s*=\s*"(?P<alt>[^"]*)"\s*\]$', re.DOTALL)
+MCQ_PATTERN = re.compile(r'^\[QUESTION:\s*(?P<question>.+?)\s*OPTIONS:\s*(?P<options>.+?)\s*ANSWER:\s*(?P<answer>[A-Za-z])\)?\s*\]$', re.DOTALL)
+SA_PATTERN = re.compile(r'^\[QUESTION_SA:\s*(?P<question>.+?)\s*KEYWORDS:\s*(?P<keywords>.+?)\s*\]$', re.DOTALL)
+OPTION_LABEL_PATTERN = re.compile(r'(?:^|(?<=[\s,;]))([A-Za-z])\)\s*')
+
+class ScriptParseError(ValueError):
+    pass
+
+def clean_text(text):
+    return html.unescape(text).replace('\xa0', ' ').strip()
+
+def find_tag_end(script_text, start):
+    depth = 0
+    for i in range(start, len(script_text)):
+        if script_text[i] == '[': depth += 1
+        elif script_text[i] == ']':
+            depth -= 1
+            if depth == 0: return i + 1
+    return -1
+
+def split_prose(text):
+    return [block.strip() for block in re.split(r'\n\s*\n', text) if clean_text(block)]
+
+# Splits a script into tag segments and prose blocks, in script order. An unterminated tag
+# is left in the trailing prose, where parse_segment rejects it.
+def split_segments(script_text):
+    segments, pos = [], 0
+    while True:
+        match = TAG_START_PATTERN.search(script_text, pos)
+        if not match: break
+        end = find_tag_end(script_text, match.start())
+        if end == -1: break
+        segments.extend(split_prose(script_text[pos:match.start()]))
+        segments.append(script_text[match.start():end])
+        pos = end
+    segments.extend(split_prose(script_text[pos:]))
+    return segments
+
+def parse_options(options_text):
+    labels = list(OPTION_LABEL_PATTERN.finditer(options_text))
+    if len(labels) < 2 or options_text[:labels[0].start()].strip():
+        raise ScriptParseError(f"Could not read the options in: {options_text!r}")
+    options = {}
+    for label, next_label in zip(labels, labels[1:] + [None]):
+        key = label.group(1).upper()
+        value = options_text[label.end():next_label.start() if next_label else len(options_text)]
+        value = clean_text(value).rstrip(',;').strip()
+        if not value or key in options:
+            raise ScriptParseError(f"Option {key} is empty or repeated in: {options_text!r}")
+        options[key] = value
+    return options
+
+def parse_segment(segment):
+    segment = segment.strip()
+    if segment.startswith('[IMAGE:'):
+        match = IMAGE_PATTERN.match(segment)
+        if not match: raise ScriptParseError(f"Malformed image tag: {segment!r}")
+        return [{'type': 'MEDIA', 'alt_text': clean_text(match.group('alt'))}]
+    if segment.startswith('[QUESTION_SA:'):
+        match = SA_PATTERN.match(segment)
+        if not match: raise ScriptParseError(f"Malformed short-answer question: {segment!r}")
+        keywords = [clean_text(k) for k in match.group('keywords').split(',') if clean_text(k)]
+        if not keywords: raise ScriptParseError(f"Short-answer question has no keywords: {segment!r}")
+        return [{'type': 'QUESTION_SA', 'question': clean_text(match.group('question')), 'keywords': keywords}]
+    if segment.startswith('[QUESTION:'):
+        match = MCQ_PATTERN.match(segment)
+        if not match: raise ScriptParseError(f"Malformed multiple-choice question: {segment!r}")
+        options = parse_options(match.group('options'))
+        answer = match.group('answer').upper()
+        if answer not in options: raise ScriptParseError(f"Answer {answer} is not one of the options: {segment!r}")
+        return [{'type': 'QUESTION_MCQ', 'question': clean_text(match.group('question')), 'options': options, 'correct_answer': answer}]
+    if UNKNOWN_TAG_PATTERN.search(segment):
+        raise ScriptParseError(f"Unrecognised or unterminated tag in: {segment!r}")
+    text = clean_text(segment)
+    return [{'type': 'CONTENT', 'text': text}] if text else []
+
+def parse_script(script_text):
+    steps = []
+    for segment in split_segments(script_text):
+        steps.extend(parse_segment(segment))
+    if not steps: raise ScriptParseError("The script has no content.")
+    return {'steps': steps}
@@ -0,0 +1,89 @@
+import hashlib
+import math
+import re
+from collections import Counter
+
+import lesson_parser
+
+# Local BM25 index over a lesson script, so a student question only needs the few passages
+# that can answer it instead of the whole chapter. Indexes are plain dicts that round-trip
+# through JSON, and carry a hash of the script they were built from.
+
+INDEX_VERSION = 1
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset('a an and are as at be but by can do does for from has have how i if in is it its me of on or so that the their them then there these they this to was what when where which who why will with you your'.split())
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English prose; close enough for budgeting.
+    return len(text) // 4 + 1
+
+def tokenize(text):
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word in STOPWORDS: continue
+        # Fold simple plurals so "capybaras" finds "capybara".
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'): word = word[:-1]
+        terms.append(word)
+    return terms
+
+def script_hash(script_text):
+    return hashlib.sha256(script_text.encode('utf-8')).hexdigest()
+
+# Packs consecutive segments (prose blocks and tags, in script order) into chunks of about
+# chunk_tokens. A tag is never split, so image alt text always stays intact.
+def chunk_script(script_text, chunk_tokens=120):
+    chunks, current, current_tokens = [], [], 0
+    for segment in lesson_parser.split_segments(script_text):
+        tokens = estimate_tokens(segment)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append('\n\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(segment)
+        current_tokens += tokens
+    if current: chunks.append('\n\n'.join(current))
+    return chunks
+
+def build_index(script_text, chunk_tokens=120):
+    chunks = []
+    document_frequency = Counter()
+    for text in chunk_script(script_text, chunk_tokens):
+        terms = Counter(tokenize(text))
+        document_frequency.update(terms.keys())
+        chunks.append({'text': text, 'tf': dict(terms), 'length': sum(terms.values())})
+    return {'version': INDEX_VERSION, 'script_hash': script_hash(script_text), 'chunks': chunks, 'df': dict(document_frequency)}
+
+def is_current(index, script_text):
+    return bool(index) and index.get('version') == INDEX_VERSION and index.get('script_hash') == script_hash(script_text)
+
+# Returns (score, chunk_number) pairs, best first, for chunks that share a term with the query.
+def search(index, query, k=4):
+    chunks = index['chunks']
+    if not chunks: return []
+    average_length = sum(chunk['length'] for chunk in chunks) / len(chunks) or 1
+    query_terms = set(tokenize(query))
+    scored = []
+    for number, chunk in enumerate(chunks):
+        score = 0.0
+        for term in query_terms:
+            frequency = chunk['tf'].get(term)
+            if not frequency: continue
+            df = index['df'][term]
+            idf = math.log(1 + (len(chunks) - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * chunk['length'] / average_length))
+        if score > 0: scored.append((score, number))
+    scored.sort(key=lambda pair: (-pair[0], pair[1]))
+    return scored[:k]
+
+# The context for a question: the whole script if it fits the budget, otherwise the best
+# matching chunks that fit, put back into script order so the excerpt still reads naturally.
+def select_context(index, script_text, query, token_budget, k=4):
+    if estimate_tokens(script_text) <= token_budget: return script_text
+    chosen, used = [], 0
+    for _, number in search(index, query, k):
+        tokens = estimate_tokens(index['chunks'][number]['text'])
+        if used + tokens > token_budget: continue
+        chosen.append(number)
+        used += tokens
+    return '\n\n[...]\n\n'.join(index['chunks'][number]['text'] for number in sorted(chosen))
@@ -0,0 +1,159 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# One place for every model call. Calls run on a bounded thread pool with per-call timeouts
+# and jittered retries, and share a single backend (and so a single GenerativeModel).
+
+class LLMError(RuntimeError):
+    pass
+
+class LLMBusyError(LLMError):
+    pass
+
+class LLMTimeoutError(LLMError):
+    pass
+
+class GeminiBackend:
+    def __init__(self, model_name, api_key=None):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt, timeout):
+        return self.model.generate_content(prompt, request_options={'timeout': timeout}).text
+
+    def stream(self, prompt, timeout):
+        for chunk in self.model.generate_content(prompt, stream=True, request_options={'timeout': timeout}):
+            if chunk.text: yield chunk.text
+
+# Offline stand-in for load tests and local development: sleeps for `latency` seconds and
+# answers with `responder(prompt)`.
+class FakeBackend:
+    def __init__(self, latency=0.0, responder=None):
+        self.latency = latency
+        self.responder = responder or (lambda prompt: f"(fake tutor) {prompt.strip()[:80]}")
+
+    def generate(self, prompt, timeout):
+        time.sleep(min(self.latency, timeout))
+        return self.responder(prompt)
+
+    def stream(self, prompt, timeout):
+        words = self.responder(prompt).split(' ')
+        for i, word in enumerate(words):
+            time.sleep(min(self.latency / max(len(words), 1), timeout))
+            yield word if i == len(words) - 1 else word + ' '
+
+def create_backend(name, model_name, api_key=None, fake_latency=0.0):
+    if name == 'gemini': return GeminiBackend(model_name, api_key=api_key)
+    if name == 'fake': return FakeBackend(latency=fake_latency)
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+class LLMGateway:
+    def __init__(self, backend, max_workers=8, max_queue=64, max_background=2, timeout=60.0, retries=2, backoff=0.5):
+        self.backend = backend
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        # Background calls (pre-generation) hold at most this many of the max_queue places, so live
+        # calls always keep the rest.
+        self.max_background = max(1, min(max_background, max_queue - 1))
+        self._background = threading.BoundedSemaphore(self.max_background)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+        # Streams run on the caller's thread, so they take a slot from the same budget as the pool.
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._pending = 0  # calls and streams admitted but not finished, capped at max_queue
+        self._pending_lock = threading.Lock()
+
+    def _admit(self):
+        with self._pending_lock:
+            if self._pending >= self.max_queue:
+                raise LLMBusyError("Too many model calls are already waiting.")
+            self._pending += 1
+
+    def _leave(self):
+        with self._pending_lock:
+            self._pending -= 1
+
+    def _sleep_before_retry(self, attempt):
+        time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def _call(self, prompt, timeout):
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    with self._slots:
+                        return self.backend.generate(prompt, timeout)
+                except Exception:
+                    if attempt == self.retries: raise
+                    self._sleep_before_retry(attempt)
+        finally:
+            self._leave()
+
+    # Queues a call and returns a Future; raises LLMBusyError instead of queueing without bound.
+    def submit(self, prompt, timeout=None):
+        self._admit()
+        try:
+            return self._executor.submit(self._call, prompt, timeout or self.timeout)
+        except Exception:
+            self._leave()
+            raise
+
+    # Like submit(), but waits for one of the max_background places, and for the queue to admit it,
+    # instead of raising LLMBusyError: background work is never refused, only held back.
+    def submit_background(self, prompt, timeout=None):
+        self._background.acquire()
+        try:
+            while True:
+                try:
+                    future = self.submit(prompt, timeout)
+                    break
+                except LLMBusyError:
+                    self._sleep_before_retry(0)
+        except Exception:
+            self._background.release()
+            raise
+        future.add_done_callback(lambda _: self._background.release())
+        return future
+
+    # The deadline covers every attempt plus the worst-case backoff between them.
+    def deadline(self, timeout=None):
+        timeout = timeout or self.timeout
+        return timeout * (self.retries + 1) + sum(self.backoff * (2 ** attempt) * 1.5 for attempt in range(self.retries))
+
+    def result(self, future, timeout=None):
+        try:
+            return future.result(timeout=self.deadline(timeout))
+        except FutureTimeoutError:
+            future.cancel()
+            raise LLMTimeoutError("The model did not answer in time.")
+
+    def generate(self, prompt, timeout=None):
+        return self.result(self.submit(prompt, timeout), timeout)
+
+    # Retries only until the first chunk arrives; after that the caller has already shown text.
+    # Streams count against max_queue like submitted calls, and give up with LLMBusyError when no
+    # slot comes free within the timeout, so a burst cannot park every request thread here.
+    def stream(self, prompt, timeout=None):
+        timeout = timeout or self.timeout
+        self._admit()
+        try:
+            for attempt in range(self.retries + 1):
+                streamed_any = False
+                if not self._slots.acquire(timeout=timeout):
+                    raise LLMBusyError("No model slot came free in time.")
+                try:
+                    for text in self.backend.stream(prompt, timeout):
+                        streamed_any = True
+                        yield text
+                    return
+                except Exception:
+                    if streamed_any or attempt == self.retries: raise
+                finally:
+                    self._slots.release()
+                self._sleep_before_retry(attempt)
+        finally:
+            self._leave()
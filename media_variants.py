@@ -0,0 +1,43 @@
+import os
+
+# Resized WebP copies of stored images, written next to the original as <key>-<width>.webp so
+# pages can offer a srcset instead of the full upload. Pillow is optional: without it no
+# variants are made and every page keeps serving the originals.
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+VARIANT_QUALITY = 80
+
+def available():
+    return Image is not None
+
+def variant_name(key, width):
+    return f"{key}-{width}.webp"
+
+# Writes a variant for every width narrower than the image and returns (image_width, widths).
+# Anything that is not a still image (video, audio, animations, SVG, unreadable files) gives (None, []).
+def generate(source_path, directory, key, widths):
+    try:
+        with Image.open(source_path) as image:
+            if getattr(image, 'n_frames', 1) > 1: return None, []
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+            written = []
+            for width in sorted(set(widths)):
+                if width >= image.width: break
+                height = max(1, round(image.height * width / image.width))
+                path = os.path.join(directory, variant_name(key, width))
+                temp_path = f"{path}.tmp"
+                try:
+                    image.resize((width, height), Image.LANCZOS).save(temp_path, 'WEBP', quality=VARIANT_QUALITY)
+                    os.replace(temp_path, path)
+                finally:
+                    if os.path.exists(temp_path): os.remove(temp_path)
+                written.append(width)
+            return image.width, written
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None, []
@@ -0,0 +1,93 @@
+"""Store chat turns append-only
+
+Revision ID: d2b7e5a9c613
+Revises: a61d4f0e8c35
+Create Date: 2026-10-16 15:02:37.480215
+
+"""
+import datetime
+import json
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b7e5a9c613'
+down_revision = 'a61d4f0e8c35'
+branch_labels = None
+depends_on = None
+
+chat_history = sa.table('chat_history',
+    sa.column('id', sa.Integer), sa.column('enrollment_id', sa.Integer), sa.column('lesson_id', sa.String),
+    sa.column('history_json', sa.Text), sa.column('last_seq', sa.Integer))
+chat_turn = sa.table('chat_turn',
+    sa.column('enrollment_id', sa.Integer), sa.column('lesson_id', sa.String), sa.column('seq', sa.Integer),
+    sa.column('role', sa.String), sa.column('text', sa.Text), sa.column('created_at', sa.DateTime))
+
+
+# One chat_turn row per message of each history blob, numbered from 1.
+def explode_history_blobs(conn):
+    now = datetime.datetime.utcnow()
+    for record in conn.execute(sa.select(chat_history.c.id, chat_history.c.enrollment_id, chat_history.c.lesson_id, chat_history.c.history_json)).all():
+        try:
+            messages = json.loads(record.history_json or '[]')
+        except ValueError:
+            messages = []
+        rows = [{'enrollment_id': record.enrollment_id, 'lesson_id': record.lesson_id, 'seq': seq,
+                 'role': message.get('role', 'model'), 'text': ''.join(part.get('text', '') for part in message.get('parts', [])),
+                 'created_at': now}
+                for seq, message in enumerate(messages, start=1)]
+        if rows: conn.execute(chat_turn.insert(), rows)
+        conn.execute(chat_history.update().where(chat_history.c.id == record.id).values(last_seq=len(rows)))
+
+
+def rebuild_history_blobs(conn):
+    for record in conn.execute(sa.select(chat_history.c.id, chat_history.c.enrollment_id, chat_history.c.lesson_id)).all():
+        turns = conn.execute(sa.select(chat_turn.c.role, chat_turn.c.text)
+                             .where(chat_turn.c.enrollment_id == record.enrollment_id, chat_turn.c.lesson_id == record.lesson_id)
+                             .order_by(chat_turn.c.seq)).all()
+        history = [{'role': turn.role, 'parts': [{'text': turn.text}]} for turn in turns]
+        conn.execute(chat_history.update().where(chat_history.c.id == record.id).values(history_json=json.dumps(history)))
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('chat_turn',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('enrollment_id', sa.Integer(), nullable=False),
+    sa.Column('lesson_id', sa.String(length=36), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('role', sa.String(length=10), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['enrollment_id'], ['enrollment.id'], ),
+    sa.ForeignKeyConstraint(['lesson_id'], ['lesson.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('enrollment_id', 'lesson_id', 'seq', name='_enrollment_lesson_seq_uc')
+    )
+    with op.batch_alter_table('chat_history', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_seq', sa.Integer(), server_default='0', nullable=False))
+
+    # ### end Alembic commands ###
+    # Offline (--sql) runs have no rows to read, so they only emit the schema changes.
+    if not context.is_offline_mode():
+        explode_history_blobs(op.get_bind())
+
+    with op.batch_alter_table('chat_history', schema=None) as batch_op:
+        batch_op.drop_column('history_json')
+
+
+def downgrade():
+    with op.batch_alter_table('chat_history', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('history_json', sa.TEXT(), server_default='[]', nullable=False))
+
+    if not context.is_offline_mode():
+        rebuild_history_blobs(op.get_bind())
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('chat_history', schema=None) as batch_op:
+        batch_op.drop_column('last_seq')
+
+    op.drop_table('chat_turn')
+    # ### end Alembic commands ###
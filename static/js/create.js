@@ -8,6 +8,43 @@ document.addEventListener('DOMContentLoaded', () => {
     // This will hold the files to be submitted with the final form
     const fileStore = new DataTransfer();
 
+    // On the edit page every existing image is shown right after its [IMAGE] tag. The preview
+    // carries the image's url, so each tag keeps its own picture however tags around it change.
+    const existingUrls = editor.dataset.mediaUrls ? JSON.parse(editor.dataset.mediaUrls) : null;
+    const keepsExisting = existingUrls !== null && showExistingImages(existingUrls);
+
+    function createPreview(src, altText) {
+        const previewImg = document.createElement('img');
+        previewImg.src = src;
+        previewImg.alt = altText;
+        previewImg.style.maxWidth = '200px';
+        previewImg.style.display = 'block';
+        previewImg.style.margin = '10px 0';
+        previewImg.setAttribute('contenteditable', 'false');
+        return previewImg;
+    }
+
+    // Returns false, leaving the editor alone, when the script's tags and the saved images disagree.
+    function showExistingImages(urls) {
+        const tags = [];
+        const walker = document.createTreeWalker(editor, NodeFilter.SHOW_TEXT);
+        while (walker.nextNode()) {
+            for (const match of walker.currentNode.textContent.matchAll(/\[IMAGE:[^\]]*\]/g)) {
+                tags.push({ node: walker.currentNode, end: match.index + match[0].length });
+            }
+        }
+        if (tags.length !== urls.length) return false;
+        // From the last tag back, so splitting a text node keeps the earlier offsets in it valid.
+        for (let i = tags.length - 1; i >= 0; i--) {
+            if (!urls[i]) continue;
+            const rest = tags[i].node.splitText(tags[i].end);
+            const previewImg = createPreview(urls[i], '');
+            previewImg.dataset.mediaUrl = urls[i];
+            rest.parentNode.insertBefore(previewImg, rest);
+        }
+        return true;
+    }
+
     // 1. Handle the "Add Image" button click
     addImageBtn.addEventListener('click', () => {
         imageUploadInput.click();
@@ -39,14 +76,8 @@ document.addEventListener('DOMContentLoaded', () => {
         const imageTag = `[IMAGE: alt="${altText}"]`;
         
         // Create a local URL for instant preview without uploading
-        const previewUrl = URL.createObjectURL(file);
-        const previewImg = document.createElement('img');
-        previewImg.src = previewUrl;
-        previewImg.alt = altText;
-        previewImg.style.maxWidth = '200px';
-        previewImg.style.display = 'block';
-        previewImg.style.margin = '10px 0';
-        previewImg.setAttribute('contenteditable', 'false');
+        const previewImg = createPreview(URL.createObjectURL(file), altText);
+        previewImg.dataset.upload = fileStore.items.length - 1;
 
         // Insert at the current cursor position
         const selection = window.getSelection();
@@ -66,12 +97,58 @@ document.addEventListener('DOMContentLoaded', () => {
     lessonForm.addEventListener('submit', (event) => {
         const tempDiv = document.createElement('div');
         tempDiv.innerHTML = editor.innerHTML;
-        tempDiv.querySelectorAll('img').forEach(img => img.remove());
+        // Previews become markers so we can tell which image tag each file (or existing image) belongs to
+        const shownUrls = [];
+        tempDiv.querySelectorAll('img').forEach(img => {
+            if (img.dataset.upload !== undefined) img.replaceWith(document.createTextNode(`[[upload:${img.dataset.upload}]]`));
+            else if (img.dataset.mediaUrl !== undefined) img.replaceWith(document.createTextNode(`[[kept:${shownUrls.push(img.dataset.mediaUrl) - 1}]]`));
+            else img.remove();
+        });
         let scriptText = tempDiv.innerHTML.replace(/<br\s*[\/]?>/gi, "\n");
         scriptText = scriptText.replace(/<[^>]*>?/gm, '');
+
+        // A preview sits right after its own [IMAGE] tag, so the tags before it give its position.
+        // Files whose preview was deleted from the editor are not submitted, and a tag whose
+        // existing image was deleted keeps none.
+        const uploads = new DataTransfer();
+        const positions = [];
+        const kept = [];
+        let imageTags = 0;
+        scriptText = scriptText.replace(/\[IMAGE:|\[\[(upload|kept):(\d+)\]\]/g, (match, kind, index) => {
+            if (kind === undefined) {
+                imageTags++;
+                kept.push(null);
+                return match;
+            }
+            if (imageTags > 0 && kind === 'upload') {
+                uploads.items.add(fileStore.files[Number(index)]);
+                positions.push(imageTags - 1);
+            } else if (imageTags > 0) {
+                kept[imageTags - 1] = shownUrls[Number(index)];
+            }
+            return '';
+        });
         scriptInput.value = scriptText;
 
-        // Attach the collected files to the hidden file input for submission
-        imageUploadInput.files = fileStore.files;
+        // Attach the collected files, and the image tag each one belongs to, for submission
+        let positionsInput = lessonForm.querySelector('input[name="media_positions"]');
+        if (!positionsInput) {
+            positionsInput = document.createElement('input');
+            positionsInput.type = 'hidden';
+            positionsInput.name = 'media_positions';
+            lessonForm.appendChild(positionsInput);
+        }
+        positionsInput.value = JSON.stringify(positions);
+        if (keepsExisting) {
+            let keptInput = lessonForm.querySelector('input[name="media_kept"]');
+            if (!keptInput) {
+                keptInput = document.createElement('input');
+                keptInput.type = 'hidden';
+                keptInput.name = 'media_kept';
+                lessonForm.appendChild(keptInput);
+            }
+            keptInput.value = JSON.stringify(kept);
+        }
+        imageUploadInput.files = uploads.files;
     });
 });
\ No newline at end of file
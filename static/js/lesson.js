@@ -95,15 +95,24 @@ document.addEventListener('DOMContentLoaded', () => {
     function addMessage(text, sender) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${sender}-message`;
-        messageDiv.innerHTML = text.replace(/\n/g, '<br>');
         chatBox.appendChild(messageDiv);
+        setMessageText(messageDiv, text);
+        return messageDiv;
+    }
+
+    function setMessageText(messageDiv, text) {
+        messageDiv.innerHTML = text.replace(/\n/g, '<br>');
         chatBox.scrollTop = chatBox.scrollHeight;
     }
 
-    function addMediaMessage(url, alt) {
+    function addMediaMessage(url, alt, srcset) {
         const messageDiv = document.createElement('div');
         messageDiv.className = 'message tutor-message media-message';
         const img = document.createElement('img');
+        if (srcset) {
+            img.srcset = srcset;
+            img.sizes = '(max-width: 700px) 90vw, 640px';
+        }
         img.src = url;
         img.alt = alt;
         messageDiv.appendChild(img);
@@ -128,7 +137,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (isWaitingForResponse) return;
                 const answerText = `${key}: ${questionData.options[key]}`;
                 addMessage(answerText, 'student');
-                postToChat(key, 'LESSON_FLOW');
+                advanceLesson(key, true);
             });
             optionsContainer.appendChild(button);
         }
@@ -154,12 +163,13 @@ document.addEventListener('DOMContentLoaded', () => {
             const answer = answerTextarea.value.trim();
             if (answer === "") { alert("Please type an answer."); return; }
             addMessage(answer, 'student');
-            postToChat(answer, 'LESSON_FLOW');
+            advanceLesson(answer, true);
         });
         inputArea.appendChild(submitButton);
     }
     
-    function showContinueButton() {
+    // onContinue reveals a step the last batch already fetched; without it Continue asks the server.
+    function showContinueButton(onContinue = null) {
         inputArea.innerHTML = '';
         const buttonContainer = document.createElement('div');
         buttonContainer.style.textAlign = 'right';
@@ -170,8 +180,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
         continueButton.addEventListener('click', () => {
             if (isWaitingForResponse) return;
+            if (onContinue) { onContinue(); return; }
             addMessage('Continue', 'student');
-            postToChat('Continue', 'LESSON_FLOW');
+            advanceLesson('Continue');
         });
 
         buttonContainer.appendChild(continueButton);
@@ -194,29 +205,97 @@ document.addEventListener('DOMContentLoaded', () => {
             request_type: requestType
         };
 
-        const response = await fetch('/chat', {
+        const response = await fetch('/chat/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(requestBody)
         });
 
-        const data = await response.json();
+        // The tutor's reply arrives as Server-Sent Events: meta, then tokens, then done.
+        let tutorMessageDiv = null;
+        let streamedText = '';
+        let data = {};
+        await readEventStream(response, (event, payload) => {
+            if (event === 'meta') {
+                if (payload.feedback) { addMessage(payload.feedback, 'tutor'); }
+                if (payload.media_url) { addMediaMessage(payload.media_url, "Lesson media", payload.media_srcset); }
+            } else if (event === 'token') {
+                if (!tutorMessageDiv) {
+                    systemMessage.style.display = 'none';
+                    tutorMessageDiv = addMessage('', 'tutor');
+                }
+                streamedText += payload.text;
+                setMessageText(tutorMessageDiv, streamedText);
+            } else if (event === 'done') {
+                data = payload;
+            }
+        });
 
         isWaitingForResponse = false;
         systemMessage.style.display = 'none';
         qnaInput.disabled = false;
         sendQnaBtn.disabled = false;
 
-        // Render new messages from the backend
-        if (data.feedback) { addMessage(data.feedback, 'tutor'); }
-        if (data.media_url) { addMediaMessage(data.media_url, "Lesson media"); }
-        if (data.tutor_text) { addMessage(data.tutor_text, 'tutor'); }
+        // The final text can differ from what was streamed (e.g. a resolved image request)
+        if (data.tutor_text) {
+            if (tutorMessageDiv) { setMessageText(tutorMessageDiv, data.tutor_text); }
+            else { addMessage(data.tutor_text, 'tutor'); }
+        }
+        if (requestType === 'QNA' && data.media_url) { addMediaMessage(data.media_url, "Lesson media", data.media_srcset); }
         
         if (Object.keys(data).length === 1 && data.next_step) {
-             postToChat(null, 'LESSON_FLOW');
+             advanceLesson(null);
              return;
         }
         
+        showNextInteraction(data);
+    }
+
+    // --- Batched Lesson Flow ---
+    // One request returns every step up to the next question (or the end of the chapter); the
+    // steps in between are revealed locally, one per Continue click. isAnswer marks input typed or
+    // picked at a question shown here, so only real answers count in the creator's analytics.
+    async function advanceLesson(userInput = null, isAnswer = false) {
+        isWaitingForResponse = true;
+        systemMessage.innerText = 'Guidee is thinking...';
+        systemMessage.style.display = 'block';
+        qnaInput.disabled = true;
+        sendQnaBtn.disabled = true;
+        inputArea.innerHTML = '';
+
+        let turns = [];
+        try {
+            const response = await fetch('/chat/advance', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ lesson_id: LESSON_ID, user_input: userInput, is_answer: isAnswer })
+            });
+            turns = (await response.json()).turns || [];
+        } catch (error) {
+            addMessage("I seem to be having a little trouble thinking. Could you try again?", 'tutor');
+        }
+
+        isWaitingForResponse = false;
+        systemMessage.style.display = 'none';
+        qnaInput.disabled = false;
+        sendQnaBtn.disabled = false;
+        playTurns(turns);
+    }
+
+    function playTurns(turns) {
+        const turn = turns.shift();
+        if (!turn) { showContinueButton(); return; }
+        if (turn.feedback) { addMessage(turn.feedback, 'tutor'); }
+        if (turn.media_url) { addMediaMessage(turn.media_url, "Lesson media", turn.media_srcset); }
+        if (turn.tutor_text) { addMessage(turn.tutor_text, 'tutor'); }
+        if (turns.length > 0) {
+            showContinueButton(() => playTurns(turns));
+            return;
+        }
+        showNextInteraction(turn);
+    }
+
+    function showNextInteraction(data) {
         let nextInteractionScheduled = false;
 
         if (data.is_qna_response) {
@@ -254,18 +333,43 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = 'message';
+                let payload = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) { event = line.slice(7); }
+                    else if (line.startsWith('data: ')) { payload += line.slice(6); }
+                });
+                onEvent(event, payload ? JSON.parse(payload) : {});
+            }
+        }
+    }
+
     // --- Initialization Logic ---
     function initializeLesson() {
-        if (initialHistoryRecord && initialHistoryRecord.history_json) {
-            const savedHistory = JSON.parse(initialHistoryRecord.history_json);
-            if (savedHistory && savedHistory.length > 0) {
+        if (initialTurns && initialTurns.length > 0) {
+            playTurns(initialTurns.slice());
+        } else if (initialHistoryRecord && initialHistoryRecord.history) {
+            const savedHistory = initialHistoryRecord.history;
+            if (savedHistory.length > 0) {
                 renderChatHistory(savedHistory);
                 showContinueButton();
             } else {
-                postToChat(null, 'LESSON_FLOW');
+                advanceLesson(null);
             }
         } else {
-            postToChat(null, 'LESSON_FLOW');
+            advanceLesson(null);
         }
     }
 